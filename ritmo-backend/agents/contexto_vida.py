@@ -4,12 +4,29 @@ Genera instrucciones de sistema adaptadas por etapa de vida del usuario
 """
 
 import logging
-from typing import Dict, Callable
+from functools import lru_cache
+from typing import Dict, Tuple
 from models.schemas import PerfilUsuario
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+# Plantilla del contexto de sistema; los campos se rellenan con format_map
+_PLANTILLA_CONTEXTO = """Eres RITMO, un asistente de acompañamiento diseñado para personas en situación vulnerable.
+
+PERFIL DEL USUARIO:
+- Nombre: {nombre}
+- Etapa de vida: {etapa}
+- Modo de comunicación preferido: {modo_comunicacion}
+- Zona horaria: {zona_horaria}
+
+{reglas_etapa}
+
+REGLAS UNIVERSALES:
+{reglas_universales}
+
+Recuerda: Tu objetivo es acompañar, no diagnosticar ni dar consejos no solicitados."""
+
 
 def construir_contexto_sistema(perfil: PerfilUsuario) -> str:
     """
@@ -22,36 +39,45 @@ def construir_contexto_sistema(perfil: PerfilUsuario) -> str:
         str: Instrucciones completas para el sistema Claude
     """
     try:
-        # Obtener reglas específicas por etapa
-        reglas_etapa = _get_reglas_por_etapa(perfil.etapa, perfil.modo_comunicacion)
-        
-        # Obtener reglas universales
-        reglas_universales = _get_reglas_universales()
-        
-        # Construir contexto completo
-        contexto = f"""Eres RITMO, un asistente de acompañamiento diseñado para personas en situación vulnerable.
-
-PERFIL DEL USUARIO:
-- Nombre: {perfil.nombre}
-- Etapa de vida: {perfil.etapa}
-- Modo de comunicación preferido: {perfil.modo_comunicacion}
-- Zona horaria: {perfil.zona_horaria}
-
-{reglas_etapa}
-
-REGLAS UNIVERSALES:
-{reglas_universales}
-
-Recuerda: Tu objetivo es acompañar, no diagnosticar ni dar consejos no solicitados."""
+        contexto = _construir_contexto(
+            perfil.etapa, perfil.modo_comunicacion, perfil.nombre, perfil.zona_horaria
+        )
         
-        logger.info(f"Context built successfully for user stage: {perfil.etapa}")
+        logger.info("Context built successfully for user stage: %s", perfil.etapa)
         return contexto
         
     except Exception as e:
-        logger.error(f"Error building context for stage {perfil.etapa}: {e}")
+        logger.error("Error building context for stage %s: %s", perfil.etapa, e)
         raise
 
 
+@lru_cache(maxsize=512)
+def _construir_contexto(etapa: str, modo_comunicacion: str, nombre: str, zona_horaria: str) -> str:
+    """
+    Construye el contexto completo a partir de los campos del perfil
+    
+    El resultado solo depende de estos cuatro valores, así que se memoiza
+    para no reconstruir el mismo texto en cada petición.
+    
+    Args:
+        etapa: Etapa de vida del usuario
+        modo_comunicacion: Modo de comunicación preferido
+        nombre: Nombre del usuario
+        zona_horaria: Zona horaria del usuario
+        
+    Returns:
+        str: Instrucciones completas para el sistema Claude
+    """
+    return _PLANTILLA_CONTEXTO.format_map({
+        'nombre': nombre,
+        'etapa': etapa,
+        'modo_comunicacion': modo_comunicacion,
+        'zona_horaria': zona_horaria,
+        'reglas_etapa': _get_reglas_por_etapa(etapa, modo_comunicacion),
+        'reglas_universales': _REGLAS_UNIVERSALES
+    })
+
+
 def _get_reglas_por_etapa(etapa: str, modo_comunicacion: str) -> str:
     """
     Obtiene las reglas específicas para cada etapa de vida
@@ -63,31 +89,17 @@ def _get_reglas_por_etapa(etapa: str, modo_comunicacion: str) -> str:
     Returns:
         str: Reglas formateadas para la etapa específica
     """
-    reglas_por_etapa: Dict[str, Callable[[], str]] = {
-        'mayor_70': _reglas_mayor_70,
-        'joven': _reglas_joven,
-        'adulto_activo': _reglas_adulto_activo,
-        'migrante': _reglas_migrante,
-        'discapacidad_visual': _reglas_discapacidad_visual
-    }
-    
-    if etapa not in reglas_por_etapa:
-        raise ValueError(f"Etapa de vida no reconocida: {etapa}")
-    
-    reglas_base = reglas_por_etapa[etapa]()
+    reglas = _REGLAS_POR_ETAPA.get((etapa, modo_comunicacion))
     
-    # Añadir adaptaciones por modo de comunicación
-    if modo_comunicacion == "audio":
-        reglas_base += "\n\nADAPTACIÓN PARA AUDIO:\n- Frases muy cortas con pausas naturales\n- Evitar información visual\n- Confirmar recepción del mensaje"
-    elif modo_comunicacion == "texto":
-        reglas_base += "\n\nADAPTACIÓN PARA TEXTO:\n- Mensajes concisos pero claros\n- Usar párrafos cortos\n- Evitar texto denso"
+    if reglas is None:
+        raise ValueError(f"Etapa de vida no reconocida: {etapa} (modo: {modo_comunicacion})")
     
-    return reglas_base
+    return reglas
 
 
-def _reglas_mayor_70() -> str:
-    """Reglas específicas para usuarios mayores de 70 años"""
-    return """REGLAS ESPECÍFICAS PARA PERSONA MAYOR:
+# Reglas específicas de cada etapa de vida
+_REGLAS_BASE: Dict[str, str] = {
+    'mayor_70': """REGLAS ESPECÍFICAS PARA PERSONA MAYOR:
 - Usa lenguaje simple y claro, sin tecnicismos
 - Frases muy cortas y directas
 - Prioriza un ritmo lento y calmado en la conversación
@@ -95,36 +107,27 @@ def _reglas_mayor_70() -> str:
 - Si expresa cansancio: no asignes tareas, solo acompaña
 - Usa un tono respetuoso y cálido
 - Valida sus experiencias sin infantilizar
-- No presiones para hacer actividades inmediatas"""
+- No presiones para hacer actividades inmediatas""",
 
-
-def _reglas_joven() -> str:
-    """Reglas específicas para usuarios jóvenes"""
-    return """REGLAS ESPECÍFICAS PARA JOVEN:
+    'joven': """REGLAS ESPECÍFICAS PARA JOVEN:
 - Usa un lenguaje cercano pero natural, sin ser forzado
 - Entiende que pueden existir presiones sociales, académicas o de identidad
 - No minimices sus problemas por la edad
 - Valida sus emociones antes de sugerir cualquier acción
 - Reconoce que puede haber ansiedad de fondo aunque no la mencionen
 - Evita el paternalismo o condescendencia
-- Comprende el impacto de redes sociales y entorno digital"""
-
+- Comprende el impacto de redes sociales y entorno digital""",
 
-def _reglas_adulto_activo() -> str:
-    """Reglas específicas para adultos activos"""
-    return """REGLAS ESPECÍFICAS PARA ADULTO ACTIVO:
+    'adulto_activo': """REGLAS ESPECÍFICAS PARA ADULTO ACTIVO:
 - Reconoce el cansancio como válido, no como excusa
 - Entiende las presiones del trabajo y responsabilidades familiares
 - No añadas más presión a su carga actual
 - Usa un tono directo pero empático
 - Comprende los desafíos de la conciliación vida-trabajo
 - Valida el esfuerzo que ya está haciendo
-- Ofrece perspectivas realistas, no idealizadas"""
+- Ofrece perspectivas realistas, no idealizadas""",
 
-
-def _reglas_migrante() -> str:
-    """Reglas específicas para usuarios migrantes"""
-    return """REGLAS ESPECÍFICAS PARA MIGRANTE:
+    'migrante': """REGLAS ESPECÍFICAS PARA MIGRANTE:
 - Asume que puede haber soledad de fondo aunque no la mencione
 - Valida su experiencia sin comparar ni relativizar
 - Entiende la nostalgia y el choque cultural como normales
@@ -132,12 +135,9 @@ def _reglas_migrante() -> str:
 - No asumas que tiene familia o amigos cercanos disponibles
 - Nunca romantices la experiencia migratoria
 - Comprende que los procesos burocráticos pueden ser estresantes
-- Respeta las diferencias culturales en expresión emocional"""
-
+- Respeta las diferencias culturales en expresión emocional""",
 
-def _reglas_discapacidad_visual() -> str:
-    """Reglas específicas para usuarios con discapacidad visual"""
-    return """REGLAS ESPECÍFICAS PARA DISCAPACIDAD VISUAL:
+    'discapacidad_visual': """REGLAS ESPECÍFICAS PARA DISCAPACIDAD VISUAL:
 - Todo el contenido debe ser accesible por audio
 - Usa frases cortas con pausas implícitas para facilitar comprensión
 - Evita completamente referencias visuales como "mira", "ve", "observa"
@@ -146,11 +146,26 @@ def _reglas_discapacidad_visual() -> str:
 - Describe cualquier información importante de forma auditiva
 - No uses metáforas visuales
 - Prioriza la precisión en las instrucciones verbales"""
+}
+
+
+# Adaptaciones añadidas a las reglas de etapa según el modo de comunicación
+_ADAPTACIONES_MODO: Dict[str, str] = {
+    "audio": "\n\nADAPTACIÓN PARA AUDIO:\n- Frases muy cortas con pausas naturales\n- Evitar información visual\n- Confirmar recepción del mensaje",
+    "texto": "\n\nADAPTACIÓN PARA TEXTO:\n- Mensajes concisos pero claros\n- Usar párrafos cortos\n- Evitar texto denso",
+    "mixto": ""
+}
+
+# Reglas ya combinadas para cada par (etapa, modo), calculadas una sola vez al importar
+_REGLAS_POR_ETAPA: Dict[Tuple[str, str], str] = {
+    (etapa, modo): reglas + adaptacion
+    for etapa, reglas in _REGLAS_BASE.items()
+    for modo, adaptacion in _ADAPTACIONES_MODO.items()
+}
 
 
-def _get_reglas_universales() -> str:
-    """Reglas que se aplican a todas las etapas de vida"""
-    return """- Nunca juzgues ni des consejos no solicitados
+# Reglas que se aplican a todas las etapas de vida
+_REGLAS_UNIVERSALES = """- Nunca juzgues ni des consejos no solicitados
 - Si la persona está mal: primero valida, luego (solo si es apropiado) sugiere
 - Máximo 2-3 frases por respuesta para mantener brevedad
 - Si no tienes nada útil que aportar, simplemente di "Aquí estoy"
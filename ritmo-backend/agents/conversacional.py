@@ -4,11 +4,16 @@ Genera respuestas humanas y empáticas usando la API de Claude
 """
 
 import logging
-from typing import Dict, List, Optional
+from contextlib import aclosing
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import os
 import asyncio
 from datetime import datetime
-import json
+import re
+import zlib
+
+import orjson
 
 from models.schemas import ChatResponse, PerfilUsuario, PrediccionRiesgo
 
@@ -18,6 +23,58 @@ logger = logging.getLogger(__name__)
 # Configuración de Claude API
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")
 CLAUDE_MODEL = "claude-3-sonnet-20240229"  # Modelo recomendado para conversación empática
+CLAUDE_MAX_CONCURRENCIA = 16  # Llamadas simultáneas máximas a Claude
+CLAUDE_MAX_INTENTOS = 3  # Intentos ante errores transitorios
+
+# Códigos HTTP de Claude que merecen reintento con backoff exponencial
+_ESTADOS_REINTENTABLES = frozenset({429, 500, 502, 503, 504, 529})
+
+# Palabras que indican diferentes tonos, compiladas en un único regex
+_TONO_RE = re.compile(
+    r"(?P<cel>felicidades|genial|excelente|celebrar)"
+    r"|(?P<emp>entiendo|comprendo|siento|difícil)"
+    r"|(?P<ale>adelante|puedes|ánimo|fuerza)",
+    re.IGNORECASE
+)
+
+# Indicadores de necesidad de seguimiento en el mensaje del usuario
+_SEGUIMIENTO_RE = re.compile(r"preocupado|difícil|ayuda|solo|triste", re.IGNORECASE)
+
+# Palabras del mensaje del usuario para las respuestas locales
+_NEGATIVO_RE = re.compile(r"\b(?:mal|triste|difícil)\b", re.IGNORECASE)
+_POSITIVO_RE = re.compile(r"\b(?:bien|mejor|genial)\b", re.IGNORECASE)
+
+# Sustituciones de un carácter para respuestas en modo audio
+_TABLA_AUDIO = str.maketrans({";": ","})
+
+# Plantillas de mensajes proactivos para el modo local
+_RESPUESTAS_PROACTIVAS = (
+    "Hola {nombre}, ¿cómo has estado? Me preguntaba cómo te va hoy.",
+    "¡Hola! Pensé en ti, {nombre}. ¿Cómo te encuentras?",
+    "Buenos días, {nombre}. ¿Hay algo especial en tu día de hoy?"
+)
+
+# Instrucciones añadidas al prompt del sistema según el tipo de estrategia
+_INSTRUCCIONES_ESTRATEGIA = {
+    "proactivo": "\n\nMODO PROACTIVO: Inicia una conversación cálida y acogedora. Pregunta cómo está sin ser intrusivo.",
+    "empático": "\n\nMODO EMPÁTICO: El usuario parece necesitar apoyo emocional. Valida sus sentimientos y muéstrale que no está solo."
+}
+
+# Respuestas empáticas básicas del modo local: clasificación -> (plantilla, tono)
+_RESPUESTAS_LOCALES = {
+    "negativo": (
+        "Entiendo que estés pasando por un momento difícil, {nombre}. Estoy aquí para acompañarte.",
+        "empático"
+    ),
+    "positivo": (
+        "Me alegra saber que te sientes bien, {nombre}. ¡Es genial escuchar eso!",
+        "celebratorio"
+    ),
+    "neutral": (
+        "Gracias por compartir eso conmigo, {nombre}. ¿Cómo te sientes ahora mismo?",
+        "neutral"
+    )
+}
 
 
 class ClaudeAPIClient:
@@ -31,6 +88,33 @@ class ClaudeAPIClient:
             "anthropic-version": "2023-06-01",
             "content-type": "application/json"
         }
+        self._session = None
+        self._semaforo = asyncio.Semaphore(CLAUDE_MAX_CONCURRENCIA)
+        # Campos fijos del payload; solo messages y system cambian por llamada
+        self._payload_base = {
+            "model": CLAUDE_MODEL,
+            "max_tokens": 300,  # Respuestas cortas y concisas
+            "messages": [],
+            "system": "",
+            "stream": True
+        }
+    
+    async def _get_session(self):
+        """Devuelve la sesión HTTP compartida, creándola si no existe o está cerrada"""
+        import aiohttp
+        
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=60)
+            )
+        return self._session
+    
+    async def aclose(self) -> None:
+        """Cierra la sesión HTTP compartida"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
     
     async def generar_respuesta(self, prompt: str, system_prompt: str = "") -> str:
         """
@@ -44,33 +128,99 @@ class ClaudeAPIClient:
             str: Respuesta generada por Claude
         """
         try:
-            import aiohttp
+            async with aclosing(self.generar_respuesta_stream(prompt, system_prompt)) as stream:
+                partes = [parte async for parte in stream]
+            return "".join(partes)
+                        
+        except Exception as e:
+            logger.error("Error calling Claude API: %s", e)
+            return self._generar_respuesta_fallback(prompt)
+    
+    async def _abrir_stream(self, cuerpo: bytes):
+        """
+        Envía la petición a Claude reintentando errores transitorios (429/5xx)
+        
+        El semáforo solo cubre el envío y los reintentos: se libera antes de leer el
+        cuerpo para que un consumidor abandonado no retenga el permiso. El número de
+        streams abiertos a la vez lo acota el límite del conector.
+        
+        Args:
+            cuerpo: Payload JSON ya serializado
             
-            payload = {
-                "model": CLAUDE_MODEL,
-                "max_tokens": 300,  # Respuestas cortas y concisas
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ],
-                "system": system_prompt if system_prompt else ""
-            }
+        Returns:
+            aiohttp.ClientResponse: Respuesta sin leer; quien la recibe debe liberarla
+        """
+        session = await self._get_session()
+        
+        async with self._semaforo:
+            for intento in range(CLAUDE_MAX_INTENTOS):
+                response = await session.post(self.base_url, data=cuerpo)
+                if response.status not in _ESTADOS_REINTENTABLES or intento == CLAUDE_MAX_INTENTOS - 1:
+                    return response
+                
+                response.release()
+                logger.warning("Claude API returned %s, retrying (attempt %s)", response.status, intento + 1)
+                await asyncio.sleep(0.25 * 2 ** intento)
+    
+    async def generar_respuesta_stream(
+        self, prompt: str, system_prompt: str = ""
+    ) -> AsyncIterator[str]:
+        """
+        Genera respuesta usando Claude API en modo streaming
+        
+        Si Claude falla antes de emitir texto (error HTTP, evento SSE de error o
+        respuesta vacía) se emite la respuesta de fallback.
+        
+        Args:
+            prompt: Prompt del usuario
+            system_prompt: Instrucciones del sistema
+            
+        Yields:
+            str: Fragmentos de texto a medida que llegan de Claude
+            
+        Raises:
+            Exception: Si el stream falla después de emitir texto, para que la
+                respuesta parcial no se tome por completa
+        """
+        texto_emitido = False
+        try:
+            # Copia superficial de la plantilla: puede haber varias peticiones en vuelo
+            payload = self._payload_base.copy()
+            payload["messages"] = [{"role": "user", "content": prompt}]
+            payload["system"] = system_prompt if system_prompt else ""
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.base_url, 
-                    headers=self.headers, 
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data["content"][0]["text"]
-                    else:
-                        logger.error(f"Claude API error: {response.status}")
-                        return self._generar_respuesta_fallback(prompt)
+            response = await self._abrir_stream(orjson.dumps(payload))
+            try:
+                if response.status != 200:
+                    logger.error("Claude API error: %s", response.status)
+                else:
+                    evento = b""
+                    async for linea in response.content:
+                        # Solo se decodifican los datos de eventos con texto nuevo o de error
+                        if linea.startswith(b"event:"):
+                            evento = linea[6:].strip()
+                            continue
+                        if not linea.startswith(b"data:") or evento not in (b"content_block_delta", b"error"):
+                            continue
+                        
+                        datos = orjson.loads(linea[5:])
+                        if evento == b"error":
+                            raise RuntimeError(f"Claude stream error: {datos.get('error', {}).get('type')}")
+                        
+                        texto = datos.get("delta", {}).get("text")
+                        if texto:
+                            texto_emitido = True
+                            yield texto
+            finally:
+                response.release()
                         
         except Exception as e:
-            logger.error(f"Error calling Claude API: {e}")
-            return self._generar_respuesta_fallback(prompt)
+            logger.error("Error streaming from Claude API: %s", e)
+            if texto_emitido:
+                raise
+        
+        if not texto_emitido:
+            yield self._generar_respuesta_fallback(prompt)
     
     def _generar_respuesta_fallback(self, prompt: str) -> str:
         """Genera respuesta de fallback cuando Claude no está disponible"""
@@ -81,10 +231,9 @@ class ClaudeAPIClient:
             "Valoro que me hayas contado esto. ¿Cómo ha sido tu día?",
             "Es normal sentirse así a veces. ¿Hay algo específico que te preocupa?"
         ]
-        # Seleccionar respuesta basada en el hash del prompt para consistencia
-        import hashlib
-        hash_prompt = int(hashlib.md5(prompt.encode()).hexdigest()[:8], 16)
-        return respuestas_fallback[hash_prompt % len(respuestas_fallback)]
+        # Seleccionar respuesta basada en un checksum del prompt para consistencia
+        indice = zlib.crc32(prompt.encode('utf-8')) % len(respuestas_fallback)
+        return respuestas_fallback[indice]
 
 
 # Instancia global del cliente Claude
@@ -114,7 +263,7 @@ async def generar_respuesta_chat(
         ChatResponse: Respuesta generada con metadatos
     """
     try:
-        logger.info(f"Generating chat response for user profile: {perfil.etapa}")
+        logger.info("Generating chat response for user profile: %s", perfil.etapa)
         
         if not claude_client:
             logger.warning("Claude API not available, using fallback responses")
@@ -133,15 +282,11 @@ async def generar_respuesta_chat(
             user_prompt, system_prompt
         )
         
-        # 4. Analizar y procesar la respuesta
-        tono = _determinar_tono_respuesta(respuesta_claude, estrategia)
-        necesita_seguimiento = _evaluar_necesidad_seguimiento(
-            mensaje, respuesta_claude, prediccion_riesgo
+        # 4. Analizar, limpiar y ajustar la respuesta
+        tono, necesita_seguimiento, respuesta_final = _analizar_respuesta(
+            respuesta_claude, mensaje, estrategia, prediccion_riesgo, perfil
         )
         
-        # 5. Limpiar y ajustar respuesta
-        respuesta_final = _procesar_respuesta_final(respuesta_claude, perfil)
-        
         chat_response = ChatResponse(
             respuesta=respuesta_final,
             tono=tono,
@@ -152,7 +297,7 @@ async def generar_respuesta_chat(
         return chat_response
         
     except Exception as e:
-        logger.error(f"Error generating chat response: {e}")
+        logger.error("Error generating chat response: %s", e)
         return _generar_respuesta_local(mensaje, estrategia, perfil, modo_proactivo)
 
 
@@ -163,32 +308,54 @@ def _construir_prompt_sistema(
 ) -> str:
     """Construye el prompt del sistema para Claude"""
     
+    # Solo el riesgo alto/crítico y los modos proactivo/empático cambian el prompt
+    nivel_riesgo = None
+    if prediccion_riesgo and prediccion_riesgo.nivel_riesgo in ["alto", "critico"]:
+        nivel_riesgo = prediccion_riesgo.nivel_riesgo
+    
+    tipo_estrategia = estrategia.get("tipo")
+    if tipo_estrategia not in _INSTRUCCIONES_ESTRATEGIA:
+        tipo_estrategia = None
+    
+    return _prompt_sistema_cacheado(
+        perfil.nombre, perfil.etapa, perfil.modo_comunicacion, nivel_riesgo, tipo_estrategia
+    )
+
+
+@lru_cache(maxsize=1024)
+def _prompt_sistema_cacheado(
+    nombre: str,
+    etapa: str,
+    modo_comunicacion: str,
+    nivel_riesgo: Optional[str],
+    tipo_estrategia: Optional[str]
+) -> str:
+    """Construye el prompt del sistema a partir de valores primitivos (memoizado)"""
+    
     # Base del sistema
-    system_base = f"""Eres RITMO, un asistente de acompañamiento empático para personas en situación vulnerable.
+    partes = [f"""Eres RITMO, un asistente de acompañamiento empático para personas en situación vulnerable.
 
 PERFIL DEL USUARIO:
-- Nombre: {perfil.nombre}
-- Etapa de vida: {perfil.etapa}
-- Modo de comunicación: {perfil.modo_comunicacion}
+- Nombre: {nombre}
+- Etapa de vida: {etapa}
+- Modo de comunicación: {modo_comunicacion}
 
 CARACTERÍSTICAS DE TUS RESPUESTAS:
 - Máximo 2-3 oraciones (50-80 palabras)
 - Tono cálido, humano y sin juzgar
 - Evita consejos no solicitados
 - Enfócate en validar emociones
-- Usa el nombre del usuario occasionalmente"""
+- Usa el nombre del usuario occasionalmente"""]
     
     # Añadir contexto de riesgo si existe
-    if prediccion_riesgo and prediccion_riesgo.nivel_riesgo in ["alto", "critico"]:
-        system_base += f"\n\nALERTA: El usuario muestra señales de {prediccion_riesgo.nivel_riesgo} riesgo. Sé especialmente empático y considera sugerir recursos de apoyo profesional de forma suave."
+    if nivel_riesgo:
+        partes.append(f"\n\nALERTA: El usuario muestra señales de {nivel_riesgo} riesgo. Sé especialmente empático y considera sugerir recursos de apoyo profesional de forma suave.")
     
     # Añadir instrucciones específicas de estrategia
-    if estrategia.get("tipo") == "proactivo":
-        system_base += "\n\nMODO PROACTIVO: Inicia una conversación cálida y acogedora. Pregunta cómo está sin ser intrusivo."
-    elif estrategia.get("tipo") == "empático":
-        system_base += "\n\nMODO EMPÁTICO: El usuario parece necesitar apoyo emocional. Valida sus sentimientos y muéstrale que no está solo."
+    if tipo_estrategia:
+        partes.append(_INSTRUCCIONES_ESTRATEGIA[tipo_estrategia])
     
-    return system_base
+    return "".join(partes)
 
 
 def _construir_prompt_usuario(
@@ -205,10 +372,11 @@ def _construir_prompt_usuario(
     # Construir contexto de conversación
     contexto_str = ""
     if contexto_previo:
-        contexto_str = "Contexto de conversación reciente:\n"
+        partes = ["Contexto de conversación reciente:\n"]
         for intercambio in contexto_previo[-3:]:  # Solo últimos 3 intercambios
-            contexto_str += f"Usuario: {intercambio.get('mensaje_usuario', '')}\n"
-            contexto_str += f"RITMO: {intercambio.get('respuesta_sistema', '')}\n\n"
+            partes.append(f"Usuario: {intercambio.get('mensaje_usuario', '')}\n")
+            partes.append(f"RITMO: {intercambio.get('respuesta_sistema', '')}\n\n")
+        contexto_str = "".join(partes)
     
     user_prompt = f"""{contexto_str}Mensaje actual del usuario: "{mensaje}"
     
@@ -217,16 +385,41 @@ Genera una respuesta empática y apropiada."""
     return user_prompt
 
 
+def _analizar_respuesta(
+    respuesta: str,
+    mensaje: str,
+    estrategia: Dict,
+    prediccion_riesgo: Optional[PrediccionRiesgo],
+    perfil: PerfilUsuario
+) -> Tuple[str, bool, str]:
+    """
+    Analiza la respuesta de Claude en un solo paso
+    
+    Returns:
+        Tuple con (tono, necesita_seguimiento, respuesta_final)
+    """
+    # Los espacios de los extremos no afectan al tono, así que se limpia una sola vez
+    respuesta = respuesta.strip()
+    
+    tono = _determinar_tono_respuesta(respuesta, estrategia)
+    necesita_seguimiento = _evaluar_necesidad_seguimiento(mensaje, respuesta, prediccion_riesgo)
+    respuesta_final = _procesar_respuesta_final(respuesta, perfil)
+    
+    return tono, necesita_seguimiento, respuesta_final
+
+
 def _determinar_tono_respuesta(respuesta: str, estrategia: Dict) -> str:
     """Determina el tono de la respuesta generada"""
-    respuesta_lower = respuesta.lower()
+    # Una sola pasada del regex; el tono celebratorio tiene prioridad sobre el resto
+    grupos_encontrados = set()
+    for coincidencia in _TONO_RE.finditer(respuesta):
+        if coincidencia.lastgroup == "cel":
+            return "celebratorio"
+        grupos_encontrados.add(coincidencia.lastgroup)
     
-    # Palabras que indican diferentes tonos
-    if any(palabra in respuesta_lower for palabra in ["felicidades", "genial", "excelente", "celebrar"]):
-        return "celebratorio"
-    elif any(palabra in respuesta_lower for palabra in ["entiendo", "comprendo", "siento", "difícil"]):
+    if "emp" in grupos_encontrados:
         return "empático"
-    elif any(palabra in respuesta_lower for palabra in ["adelante", "puedes", "ánimo", "fuerza"]):
+    elif "ale" in grupos_encontrados:
         return "alentador"
     else:
         return "neutral"
@@ -239,36 +432,32 @@ def _evaluar_necesidad_seguimiento(
 ) -> bool:
     """Evalúa si la respuesta necesita seguimiento posterior"""
     
-    # Indicadores de necesidad de seguimiento
-    palabras_seguimiento = ["preocupado", "difícil", "ayuda", "solo", "triste"]
-    
     if prediccion_riesgo and prediccion_riesgo.nivel_riesgo in ["alto", "critico"]:
         return True
     
-    if any(palabra in mensaje.lower() for palabra in palabras_seguimiento):
+    if _SEGUIMIENTO_RE.search(mensaje):
         return True
     
     return False
 
 
 def _procesar_respuesta_final(respuesta: str, perfil: PerfilUsuario) -> str:
-    """Procesa y ajusta la respuesta final según el perfil"""
-    
-    # Limpiar respuesta
-    respuesta = respuesta.strip()
+    """Procesa y ajusta la respuesta final según el perfil (recibe la respuesta ya limpia)"""
     
     # Ajustes por modo de comunicación
     if perfil.modo_comunicacion == "audio":
         # Para audio, evitar signos de puntuación complejos
-        respuesta = respuesta.replace("...", "")
-        respuesta = respuesta.replace(";", ",")
+        respuesta = respuesta.replace("...", "").translate(_TABLA_AUDIO)
     
     # Asegurar longitud apropiada
     if len(respuesta) > 200:
-        # Cortar en la última oración completa
-        puntos = [i for i, c in enumerate(respuesta) if c in ".!?"]
-        if puntos:
-            ultimo_punto = max([p for p in puntos if p < 180])
+        # Cortar en la última oración completa antes del carácter 180
+        ultimo_punto = max(
+            respuesta.rfind(".", 0, 180),
+            respuesta.rfind("!", 0, 180),
+            respuesta.rfind("?", 0, 180)
+        )
+        if ultimo_punto >= 0:
             respuesta = respuesta[:ultimo_punto + 1]
     
     return respuesta
@@ -283,26 +472,30 @@ def _generar_respuesta_local(
     """Genera respuesta local cuando Claude no está disponible"""
     
     if modo_proactivo:
-        respuestas_proactivas = [
-            f"Hola {perfil.nombre}, ¿cómo has estado? Me preguntaba cómo te va hoy.",
-            f"¡Hola! Pensé en ti, {perfil.nombre}. ¿Cómo te encuentras?",
-            f"Buenos días, {perfil.nombre}. ¿Hay algo especial en tu día de hoy?"
-        ]
-        respuesta = respuestas_proactivas[0]  # Simplificado
+        clasificacion = "proactivo"
+    elif _NEGATIVO_RE.search(mensaje):
+        clasificacion = "negativo"
+    elif _POSITIVO_RE.search(mensaje):
+        clasificacion = "positivo"
     else:
-        # Respuestas empáticas básicas
-        if any(palabra in mensaje.lower() for palabra in ["mal", "triste", "difícil"]):
-            respuesta = f"Entiendo que estés pasando por un momento difícil, {perfil.nombre}. Estoy aquí para acompañarte."
-            tono = "empático"
-        elif any(palabra in mensaje.lower() for palabra in ["bien", "mejor", "genial"]):
-            respuesta = f"Me alegra saber que te sientes bien, {perfil.nombre}. ¡Es genial escuchar eso!"
-            tono = "celebratorio"
-        else:
-            respuesta = f"Gracias por compartir eso conmigo, {perfil.nombre}. ¿Cómo te sientes ahora mismo?"
-            tono = "neutral"
+        clasificacion = "neutral"
+    
+    respuesta, tono = _texto_respuesta_local(perfil.nombre, clasificacion)
     
     return ChatResponse(
         respuesta=respuesta,
-        tono=tono if 'tono' in locals() else "empático",
+        tono=tono,
         necesita_seguimiento=False
-    )
\ No newline at end of file
+    )
+
+
+@lru_cache(maxsize=256)
+def _texto_respuesta_local(nombre: str, clasificacion: str) -> Tuple[str, str]:
+    """Devuelve (respuesta, tono) de la respuesta local para un nombre y clasificación"""
+    if clasificacion == "proactivo":
+        # Elegir la plantilla por el nombre y formatear solo esa
+        indice = zlib.crc32(nombre.encode('utf-8')) % len(_RESPUESTAS_PROACTIVAS)
+        return _RESPUESTAS_PROACTIVAS[indice].format(nombre=nombre), "empático"
+    
+    plantilla, tono = _RESPUESTAS_LOCALES[clasificacion]
+    return plantilla.format(nombre=nombre), tono
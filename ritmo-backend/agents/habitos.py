@@ -5,9 +5,9 @@ Promueve rutinas saludables y el desarrollo de hábitos positivos
 """
 
 import logging
-from typing import Dict, List, Optional
-from datetime import datetime, time
+from typing import Dict, List, Optional, Tuple
 import random
+import time
 
 from models.schemas import PerfilUsuario, ChatResponse
 
@@ -15,12 +15,98 @@ from models.schemas import PerfilUsuario, ChatResponse
 logger = logging.getLogger(__name__)
 
 
+# Saludos personalizados por momento; solo se formatea el elegido
+_SALUDOS = {
+    "mañana": (
+        "¡Buenos días, {nombre}!",
+        "Qué bueno verte por aquí, {nombre}",
+        "¡Hola, {nombre}! ¿Cómo amaneciste?"
+    ),
+    "tarde": (
+        "¡Hola, {nombre}!",
+        "Buenas tardes, {nombre}",
+        "¿Cómo va tu día, {nombre}?"
+    ),
+    "noche": (
+        "¡Hola, {nombre}!",
+        "Buenas noches, {nombre}",
+        "Espero que hayas tenido un buen día, {nombre}"
+    )
+}
+
+# Conectores motivacionales
+_CONECTORES = (
+    "Me preguntaba si te gustaría probar",
+    "Tengo una idea que podría gustarte:",
+    "¿Qué te parece si intentamos",
+    "Se me ocurrió que podrías disfrutar",
+    "¿Te animas a"
+)
+
+# Motivación final
+_MOTIVACIONES = (
+    "Los pequeños cambios crean grandes resultados.",
+    "Cada paso cuenta, por pequeño que sea.",
+    "Es genial cuidarte de esta manera.",
+    "Tu bienestar es importante.",
+    "Te mereces estos momentos para ti."
+)
+
+# Preguntas de seguimiento suave
+_SEGUIMIENTOS = (
+    "¿Te parece algo que podrías intentar?",
+    "¿Crees que podría funcionar para ti?",
+    "¿Qué opinas?",
+    "¿Te suena bien?",
+    "¿Te gustaría probarlo?"
+)
+
+# Mensajes de fallback cuando hay errores
+_MENSAJES_FALLBACK = (
+    "Hola {nombre}, espero que estés teniendo un buen día. ¿Hay algo especial que te gustaría hacer hoy?",
+    "¡Qué bueno verte, {nombre}! A veces los pequeños momentos para nosotros mismos hacen la diferencia.",
+    "Hola {nombre}. ¿Cómo has estado? Me alegra saber de ti."
+)
+
+
+# Palabras clave que identifican los hábitos más simples
+_PALABRAS_HABITO_SIMPLE = frozenset(("respirar", "agua", "música", "caminar"))
+
+
+def _es_habito_simple(habito: str) -> bool:
+    """Indica si el hábito contiene alguna palabra clave de hábito simple"""
+    habito_normalizado = habito.casefold()
+    return any(palabra in habito_normalizado for palabra in _PALABRAS_HABITO_SIMPLE)
+
+
+def _filtrar_habitos_simples(habitos: List[str]) -> Tuple[str, ...]:
+    """Devuelve los hábitos más simples (respirar, agua, música, caminar)"""
+    return tuple(h for h in habitos if _es_habito_simple(h))
+
+
+# Hábitos generales cuando la etapa o el momento no tienen hábitos propios
+_HABITOS_GENERALES = (
+    "Tomar un momento para respirar profundo",
+    "Hacer algo que te haga sentir bien",
+    "Conectar con alguien importante para ti"
+)
+_HABITOS_GENERALES_SIMPLES = _filtrar_habitos_simples(_HABITOS_GENERALES)
+
+
 class AgenteHabitos:
     """Agente especializado en promover hábitos saludables"""
     
+    __slots__ = (
+        "habitos_por_etapa",
+        "momentos_rutina",
+        "habitos_por_momento",
+        "habitos_simples_por_momento"
+    )
+    
     def __init__(self):
         self.habitos_por_etapa = self._inicializar_habitos_por_etapa()
         self.momentos_rutina = self._inicializar_momentos_rutina()
+        self.habitos_por_momento, self.habitos_simples_por_momento = self._indexar_habitos()
     
     def _inicializar_habitos_por_etapa(self) -> Dict[str, Dict[str, List[str]]]:
         """Inicializa hábitos recomendados por etapa de vida"""
@@ -134,12 +220,29 @@ class AgenteHabitos:
             "tarde": "15:00-17:00", 
             "noche": "19:00-21:00"
         }
+    
+    def _indexar_habitos(self) -> Tuple[Dict[Tuple[str, str], Tuple[str, ...]], Dict[Tuple[str, str], Tuple[str, ...]]]:
+        """
+        Indexa los hábitos por (etapa, momento) y precalcula los hábitos simples
+        
+        Returns:
+            Tuple con el índice completo y el índice de hábitos simples
+        """
+        habitos_por_momento = {}
+        habitos_simples_por_momento = {}
+        
+        for etapa, habitos_etapa in self.habitos_por_etapa.items():
+            for momento, habitos in habitos_etapa.items():
+                habitos_por_momento[(etapa, momento)] = tuple(habitos)
+                habitos_simples_por_momento[(etapa, momento)] = _filtrar_habitos_simples(habitos)
+        
+        return habitos_por_momento, habitos_simples_por_momento
 
 
 agente_habitos = AgenteHabitos()
 
 
-async def generar_mensaje_habito(
+def generar_mensaje_habito(
     perfil: PerfilUsuario,
     dias_sin_actividad: int
 ) -> ChatResponse:
@@ -186,13 +289,14 @@ async def generar_mensaje_habito(
 
 def _determinar_momento_dia() -> str:
     """Determina el momento del día actual"""
-    hora_actual = datetime.now().time()
+    ahora = time.localtime()
+    minutos = ahora.tm_hour * 60 + ahora.tm_min
     
-    if time(6, 0) <= hora_actual <= time(11, 0):
+    if 360 <= minutos <= 660:  # 06:00-11:00
         return "mañana"
-    elif time(14, 0) <= hora_actual <= time(18, 0):
+    elif 840 <= minutos <= 1080:  # 14:00-18:00
         return "tarde"
-    elif time(19, 0) <= hora_actual <= time(22, 0):
+    elif 1140 <= minutos <= 1320:  # 19:00-22:00
         return "noche"
     else:
         return "tarde"  # Default para horas atípicas
@@ -205,20 +309,16 @@ def _seleccionar_habito_personalizado(
 ) -> str:
     """Selecciona hábito personalizado según perfil y momento"""
     
-    habitos_etapa = agente_habitos.habitos_por_etapa.get(perfil.etapa, {})
-    habitos_momento = habitos_etapa.get(momento_dia, [])
+    clave = (perfil.etapa, momento_dia)
     
-    if not habitos_momento:
-        # Fallback a hábitos generales
-        habitos_momento = [
-            "Tomar un momento para respirar profundo",
-            "Hacer algo que te haga sentir bien",
-            "Conectar con alguien importante para ti"
-        ]
+    # Fallback a hábitos generales si la etapa o el momento no tienen hábitos
+    habitos_momento = agente_habitos.habitos_por_momento.get(clave, _HABITOS_GENERALES)
     
     # Si hay muchos días sin actividad, priorizar hábitos más simples
     if dias_sin_actividad > 3:
-        habitos_simples = [h for h in habitos_momento if any(palabra in h.lower() for palabra in ["respirar", "agua", "música", "caminar"])]
+        habitos_simples = agente_habitos.habitos_simples_por_momento.get(
+            clave, _HABITOS_GENERALES_SIMPLES
+        )
         if habitos_simples:
             habitos_momento = habitos_simples
     
@@ -232,77 +332,24 @@ def _construir_mensaje_habito(
 ) -> str:
     """Construye mensaje motivacional para el hábito"""
     
-    # Saludos personalizados por momento
-    saludos = {
-        "mañana": [
-            f"¡Buenos días, {perfil.nombre}!",
-            f"Qué bueno verte por aquí, {perfil.nombre}",
-            f"¡Hola, {perfil.nombre}! ¿Cómo amaneciste?"
-        ],
-        "tarde": [
-            f"¡Hola, {perfil.nombre}!",
-            f"Buenas tardes, {perfil.nombre}",
-            f"¿Cómo va tu día, {perfil.nombre}?"
-        ],
-        "noche": [
-            f"¡Hola, {perfil.nombre}!",
-            f"Buenas noches, {perfil.nombre}",
-            f"Espero que hayas tenido un buen día, {perfil.nombre}"
-        ]
-    }
-    
-    saludo = random.choice(saludos[momento_dia])
-    
-    # Conectores motivacionales
-    conectores = [
-        "Me preguntaba si te gustaría probar",
-        "Tengo una idea que podría gustarte:",
-        "¿Qué te parece si intentamos",
-        "Se me ocurrió que podrías disfrutar",
-        "¿Te animas a"
-    ]
-    
-    conector = random.choice(conectores)
-    
-    # Motivación final
-    motivaciones = [
-        "Los pequeños cambios crean grandes resultados.",
-        "Cada paso cuenta, por pequeño que sea.",
-        "Es genial cuidarte de esta manera.",
-        "Tu bienestar es importante.",
-        "Te mereces estos momentos para ti."
-    ]
-    
-    motivacion = random.choice(motivaciones)
+    saludos = _SALUDOS[momento_dia]
+    saludo = random.choice(saludos).format(nombre=perfil.nombre)
+    conector = random.choice(_CONECTORES)
+    motivacion = random.choice(_MOTIVACIONES)
     
     return f"{saludo} {conector} {habito.lower()}? {motivacion}"
 
 
 def _generar_seguimiento_habito(habito: str, momento_dia: str) -> str:
     """Genera pregunta de seguimiento suave"""
-    
-    seguimientos = [
-        "¿Te parece algo que podrías intentar?",
-        "¿Crees que podría funcionar para ti?",
-        "¿Qué opinas?",
-        "¿Te suena bien?",
-        "¿Te gustaría probarlo?"
-    ]
-    
-    return random.choice(seguimientos)
+    return random.choice(_SEGUIMIENTOS)
 
 
 def _generar_mensaje_habito_fallback(perfil: PerfilUsuario) -> ChatResponse:
     """Genera mensaje de fallback cuando hay errores"""
     
-    mensajes_fallback = [
-        f"Hola {perfil.nombre}, espero que estés teniendo un buen día. ¿Hay algo especial que te gustaría hacer hoy?",
-        f"¡Qué bueno verte, {perfil.nombre}! A veces los pequeños momentos para nosotros mismos hacen la diferencia.",
-        f"Hola {perfil.nombre}. ¿Cómo has estado? Me alegra saber de ti."
-    ]
-    
     return ChatResponse(
-        respuesta=random.choice(mensajes_fallback),
+        respuesta=random.choice(_MENSAJES_FALLBACK).format(nombre=perfil.nombre),
         tono="alentador",
         necesita_seguimiento=False
     )
@@ -332,13 +379,13 @@ def es_buen_momento_para_habitos(hora_actual: str) -> bool:
         bool: True si es buen momento para hábitos
     """
     try:
-        hora, minuto = map(int, hora_actual.split(':'))
-        hora_decimal = hora + minuto / 60
+        hora, _, minuto = hora_actual.partition(':')
+        minutos = int(hora) * 60 + int(minuto)
         
         # Buenos momentos: mañana (8-11), tarde (15-17), noche temprana (19-21)
-        return ((8 <= hora_decimal <= 11) or 
-                (15 <= hora_decimal <= 17) or 
-                (19 <= hora_decimal <= 21))
+        return ((480 <= minutos <= 660) or 
+                (900 <= minutos <= 1020) or 
+                (1140 <= minutos <= 1260))
                 
     except ValueError:
         return False
\ No newline at end of file
@@ -5,9 +5,11 @@ Coordina todos los agentes y estrategias de respuesta
 """
 
 import logging
-from typing import Dict, List, Optional, Any
-from datetime import datetime, time
+from functools import lru_cache
+from typing import Dict, List, Mapping, NamedTuple, Optional, Any
+from time import time_ns
 from enum import Enum
+from types import MappingProxyType
 
 from models.schemas import EstadoInferido, PerfilUsuario, PrediccionRiesgo
 
@@ -15,7 +17,7 @@ from models.schemas import EstadoInferido, PerfilUsuario, PrediccionRiesgo
 logger = logging.getLogger(__name__)
 
 
-class DecisionOrquestador(Enum):
+class DecisionOrquestador(str, Enum):
     """Decisiones posibles del orquestador"""
     RESPONDER = "responder"
     ESPERAR = "esperar"
@@ -24,7 +26,7 @@ class DecisionOrquestador(Enum):
     RUTINA = "rutina"
 
 
-class TipoEstrategia(Enum):
+class TipoEstrategia(str, Enum):
     """Tipos de estrategia de respuesta"""
     EMPATICO = "empático"
     ALENTADOR = "alentador"
@@ -34,65 +36,120 @@ class TipoEstrategia(Enum):
     URGENTE = "urgente"
 
 
+class Regla(NamedTuple):
+    """Regla de decisión base para un estado inferido"""
+    decision: DecisionOrquestador
+    estrategia: TipoEstrategia
+    prioridad: str
+    tiempo_respuesta_seg: int
+
+
+# Reglas de decisión por estado y contexto
+REGLAS_DECISION: Mapping[str, Regla] = MappingProxyType({
+    "critico": Regla(
+        decision=DecisionOrquestador.CONTACTO_SUAVE,
+        estrategia=TipoEstrategia.URGENTE,
+        prioridad="alta",
+        tiempo_respuesta_seg=30
+    ),
+    "ansiedad": Regla(
+        decision=DecisionOrquestador.CONTACTO_SUAVE,
+        estrategia=TipoEstrategia.EMPATICO,
+        prioridad="media",
+        tiempo_respuesta_seg=60
+    ),
+    "aislamiento": Regla(
+        decision=DecisionOrquestador.CONTACTO_SUAVE,
+        estrategia=TipoEstrategia.EMPATICO,
+        prioridad="media",
+        tiempo_respuesta_seg=300  # 5 minutos
+    ),
+    "cansancio": Regla(
+        decision=DecisionOrquestador.RESPONDER,
+        estrategia=TipoEstrategia.ALENTADOR,
+        prioridad="baja",
+        tiempo_respuesta_seg=600  # 10 minutos
+    ),
+    "estable": Regla(
+        decision=DecisionOrquestador.RUTINA,
+        estrategia=TipoEstrategia.HABITOS,
+        prioridad="baja",
+        tiempo_respuesta_seg=1800  # 30 minutos
+    ),
+    "desconexion": Regla(
+        decision=DecisionOrquestador.ESPERAR,
+        estrategia=TipoEstrategia.NEUTRAL,
+        prioridad="baja",
+        tiempo_respuesta_seg=3600  # 1 hora
+    )
+})
+
+# Umbrales para predicción ML de riesgo
+UMBRALES_RIESGO: Mapping[str, float] = MappingProxyType({
+    "critico": 0.8,
+    "alto": 0.6,
+    "medio": 0.4,
+    "bajo": 0.2
+})
+
+# Bases compartidas de las estrategias especiales; cada llamada añade sus campos dinámicos
+_ESTRATEGIA_CRITICA_BASE: Mapping[str, Any] = MappingProxyType({
+    "decision": DecisionOrquestador.CONTACTO_SUAVE,
+    "estrategia": TipoEstrategia.URGENTE,
+    "prioridad": "critica",
+    "tiempo_respuesta_seg": 15
+})
+_RECURSOS_CRISIS = ("linea_crisis", "profesional_salud")
+
+_ESTRATEGIA_SILENCIO_BASE: Mapping[str, Any] = MappingProxyType({
+    "decision": DecisionOrquestador.SILENCIO,
+    "estrategia": TipoEstrategia.NEUTRAL,
+    "prioridad": "ninguna",
+    "tiempo_respuesta_seg": None
+})
+
+_ESTRATEGIA_FALLBACK: Mapping[str, Any] = MappingProxyType({
+    "decision": DecisionOrquestador.ESPERAR,
+    "estrategia": TipoEstrategia.NEUTRAL,
+    "prioridad": "baja",
+    "tiempo_respuesta_seg": 600,
+    "razon": "Estrategia de fallback por error"
+})
+
+# Estados en los que no se envían mensajes proactivos (deben ser reactivos)
+_ESTADOS_SIN_PROACTIVO = frozenset(("ansiedad", "aislamiento", "desconexion"))
+
+# Estrategia de chat según el tono detectado en el mensaje del usuario
+_MAPEO_TONO_ESTRATEGIA: Mapping[str, TipoEstrategia] = MappingProxyType({
+    "positivo": TipoEstrategia.ALENTADOR,
+    "negativo": TipoEstrategia.EMPATICO,
+    "neutral": TipoEstrategia.NEUTRAL,
+    "urgente": TipoEstrategia.URGENTE
+})
+
+# Plantilla de estrategia de chat para mensajes urgentes
+_ESTRATEGIA_CHAT_URGENTE: Mapping[str, Any] = MappingProxyType({
+    "tipo": "urgente",
+    "estrategia": TipoEstrategia.URGENTE,
+    "prioridad": "critica",
+    "tiempo_respuesta_seg": 15
+})
+
+
 class OrquestadorCentral:
     """
     Orquestador central que decide cómo y cuándo responder
     Integra análisis de patrones, predicción ML y contexto del usuario
     """
     
-    def __init__(self):
-        self.reglas_decision = self._inicializar_reglas_decision()
-        self.umbrales_riesgo = self._inicializar_umbrales_riesgo()
+    __slots__ = ("reglas_decision", "umbrales_riesgo", "_estrategia_cacheada")
     
-    def _inicializar_reglas_decision(self) -> Dict[str, Dict]:
-        """Inicializa reglas de decisión por estado y contexto"""
-        return {
-            "critico": {
-                "decision": DecisionOrquestador.CONTACTO_SUAVE,
-                "estrategia": TipoEstrategia.URGENTE,
-                "prioridad": "alta",
-                "tiempo_respuesta_seg": 30
-            },
-            "ansiedad": {
-                "decision": DecisionOrquestador.CONTACTO_SUAVE,
-                "estrategia": TipoEstrategia.EMPATICO,
-                "prioridad": "media",
-                "tiempo_respuesta_seg": 60
-            },
-            "aislamiento": {
-                "decision": DecisionOrquestador.CONTACTO_SUAVE,
-                "estrategia": TipoEstrategia.EMPATICO,
-                "prioridad": "media", 
-                "tiempo_respuesta_seg": 300  # 5 minutos
-            },
-            "cansancio": {
-                "decision": DecisionOrquestador.RESPONDER,
-                "estrategia": TipoEstrategia.ALENTADOR,
-                "prioridad": "baja",
-                "tiempo_respuesta_seg": 600  # 10 minutos
-            },
-            "estable": {
-                "decision": DecisionOrquestador.RUTINA,
-                "estrategia": TipoEstrategia.HABITOS,
-                "prioridad": "baja",
-                "tiempo_respuesta_seg": 1800  # 30 minutos
-            },
-            "desconexion": {
-                "decision": DecisionOrquestador.ESPERAR,
-                "estrategia": TipoEstrategia.NEUTRAL,
-                "prioridad": "baja",
-                "tiempo_respuesta_seg": 3600  # 1 hora
-            }
-        }
-    
-    def _inicializar_umbrales_riesgo(self) -> Dict[str, float]:
-        """Inicializa umbrales para predicción ML de riesgo"""
-        return {
-            "critico": 0.8,
-            "alto": 0.6,
-            "medio": 0.4,
-            "bajo": 0.2
-        }
+    def __init__(self):
+        # Tablas compartidas (solo lectura) definidas a nivel de módulo
+        self.reglas_decision = REGLAS_DECISION
+        self.umbrales_riesgo = UMBRALES_RIESGO
+        # Memoización por instancia de la parte pura de la decisión
+        self._estrategia_cacheada = lru_cache(maxsize=4096)(self._calcular_estrategia)
     
     def decidir_estrategia_respuesta(
         self,
@@ -120,30 +177,29 @@ class OrquestadorCentral:
         try:
             logger.info(f"Making orchestrator decision for state: {estado_inferido.estado}")
             
-            # 1. Evaluar situación crítica (predicción ML tiene prioridad)
-            if prediccion_riesgo and prediccion_riesgo.probabilidad_riesgo >= self.umbrales_riesgo["critico"]:
-                return self._estrategia_situacion_critica(prediccion_riesgo, perfil)
+            riesgo = prediccion_riesgo.probabilidad_riesgo if prediccion_riesgo is not None else 0.0
+            es_critico = riesgo >= self.umbrales_riesgo["critico"]
             
-            # 2. Evaluar horario (silencio en horas inapropiadas)
-            if self._es_hora_silencio(hora_actual):
+            # 1. Evaluar horario (silencio en horas inapropiadas, salvo situación crítica)
+            if not es_critico and self._es_hora_silencio(hora_actual):
                 return self._estrategia_silencio(hora_actual)
             
-            # 3. Aplicar reglas por estado inferido
-            regla_base = self.reglas_decision.get(estado_inferido.estado)
-            if not regla_base:
-                regla_base = self.reglas_decision["estable"]  # Fallback
+            # 2. Evaluar situación crítica (predicción ML tiene prioridad sobre el silencio)
+            if es_critico:
+                return self._estrategia_situacion_critica(prediccion_riesgo, perfil)
             
-            # 4. Ajustar estrategia por contexto específico
-            estrategia = self._ajustar_estrategia_por_contexto(
-                regla_base.copy(),
-                estado_inferido,
-                prediccion_riesgo,
-                perfil,
-                dias_sin_actividad
+            # 3-4. Aplicar reglas por estado inferido y ajustar por contexto
+            #      (solo >5 días sin actividad cambia la regla, así que se agrupan)
+            regla = self._estrategia_cacheada(
+                estado_inferido.estado,
+                estado_inferido.confianza,
+                prediccion_riesgo.nivel_riesgo if prediccion_riesgo else None,
+                perfil.etapa,
+                min(dias_sin_actividad, 6)
             )
             
             # 5. Validar y finalizar estrategia
-            estrategia_final = self._validar_estrategia(estrategia, perfil, hora_actual)
+            estrategia_final = self._validar_estrategia(regla, perfil, hora_actual)
             
             logger.info(f"Orchestrator decision: {estrategia_final['decision']} with strategy {estrategia_final['estrategia']}")
             return estrategia_final
@@ -176,22 +232,10 @@ class OrquestadorCentral:
         try:
             # 1. Evaluar urgencia del mensaje
             if tono_usuario == "urgente" or (prediccion_riesgo and prediccion_riesgo.nivel_riesgo == "critico"):
-                return {
-                    "tipo": "urgente",
-                    "estrategia": TipoEstrategia.URGENTE,
-                    "prioridad": "critica",
-                    "tiempo_respuesta_seg": 15
-                }
+                return dict(_ESTRATEGIA_CHAT_URGENTE)
             
             # 2. Mapear tono a estrategia
-            mapeo_tono_estrategia = {
-                "positivo": TipoEstrategia.ALENTADOR,
-                "negativo": TipoEstrategia.EMPATICO,
-                "neutral": TipoEstrategia.NEUTRAL,
-                "urgente": TipoEstrategia.URGENTE
-            }
-            
-            estrategia = mapeo_tono_estrategia.get(tono_usuario, TipoEstrategia.NEUTRAL)
+            estrategia = _MAPEO_TONO_ESTRATEGIA.get(tono_usuario, TipoEstrategia.NEUTRAL)
             
             # 3. Ajustar por contexto de conversación
             if self._detectar_patron_repetitivo(contexto_previo):
@@ -228,7 +272,7 @@ class OrquestadorCentral:
         """
         try:
             # 1. No enviar si está en estado crítico (debe ser reactivo)
-            if estado.estado in ["ansiedad", "aislamiento", "desconexion"]:
+            if estado.estado in _ESTADOS_SIN_PROACTIVO:
                 return False
             
             # 2. Enviar si hay muchos días sin actividad y estado es estable
@@ -253,118 +297,125 @@ class OrquestadorCentral:
     ) -> Dict[str, Any]:
         """Estrategia para situaciones críticas"""
         return {
-            "decision": DecisionOrquestador.CONTACTO_SUAVE,
-            "estrategia": TipoEstrategia.URGENTE,
-            "prioridad": "critica",
-            "tiempo_respuesta_seg": 15,
+            **_ESTRATEGIA_CRITICA_BASE,
             "factores_riesgo": prediccion_riesgo.factores_riesgo,
             "requiere_escalacion": True,
-            "recursos_sugeridos": ["linea_crisis", "profesional_salud"]
+            "recursos_sugeridos": list(_RECURSOS_CRISIS)
         }
     
     def _estrategia_silencio(self, hora_actual: str) -> Dict[str, Any]:
         """Estrategia de silencio para horas inapropiadas"""
-        return {
-            "decision": DecisionOrquestador.SILENCIO,
-            "estrategia": TipoEstrategia.NEUTRAL,
-            "prioridad": "ninguna",
-            "tiempo_respuesta_seg": None,
-            "razon": f"Hora de silencio: {hora_actual}"
-        }
+        return {**_ESTRATEGIA_SILENCIO_BASE, "razon": f"Hora de silencio: {hora_actual}"}
+    
+    def _calcular_estrategia(
+        self,
+        estado: str,
+        confianza: str,
+        nivel_riesgo: Optional[str],
+        etapa: str,
+        dias_sin_actividad: int
+    ) -> Regla:
+        """
+        Calcula la estrategia ajustada a partir de valores primitivos
+        
+        Returns:
+            Regla inmutable para poder memoizarla
+        """
+        regla_base = self.reglas_decision.get(estado)
+        if not regla_base:
+            regla_base = self.reglas_decision["estable"]  # Fallback
+        
+        return self._ajustar_estrategia_por_contexto(
+            regla_base,
+            confianza,
+            nivel_riesgo,
+            etapa,
+            dias_sin_actividad
+        )
     
     def _ajustar_estrategia_por_contexto(
         self,
-        estrategia_base: Dict,
-        estado_inferido: EstadoInferido,
-        prediccion_riesgo: Optional[PrediccionRiesgo],
-        perfil: PerfilUsuario,
+        regla_base: Regla,
+        confianza: str,
+        nivel_riesgo: Optional[str],
+        etapa: str,
         dias_sin_actividad: int
-    ) -> Dict[str, Any]:
-        """Ajusta estrategia base según contexto específico"""
+    ) -> Regla:
+        """Ajusta la regla base según contexto específico"""
+        decision, estrategia, prioridad, tiempo_respuesta = regla_base
         
         # Ajuste por nivel de confianza del estado inferido
-        if estado_inferido.confianza == "baja":
-            estrategia_base["estrategia"] = TipoEstrategia.NEUTRAL
-            estrategia_base["tiempo_respuesta_seg"] *= 2
+        if confianza == "baja":
+            estrategia = TipoEstrategia.NEUTRAL
+            tiempo_respuesta *= 2
         
         # Ajuste por predicción ML
-        if prediccion_riesgo:
-            if prediccion_riesgo.nivel_riesgo == "alto":
-                estrategia_base["prioridad"] = "alta"
-                estrategia_base["tiempo_respuesta_seg"] = min(estrategia_base["tiempo_respuesta_seg"], 120)
+        if nivel_riesgo:
+            if nivel_riesgo == "alto":
+                prioridad = "alta"
+                tiempo_respuesta = min(tiempo_respuesta, 120)
         
         # Ajuste por días sin actividad
         if dias_sin_actividad > 5:
-            estrategia_base["decision"] = DecisionOrquestador.CONTACTO_SUAVE
-            estrategia_base["prioridad"] = "media"
+            decision = DecisionOrquestador.CONTACTO_SUAVE
+            prioridad = "media"
         
         # Ajuste por etapa de vida
-        if perfil.etapa == "mayor_70":
+        if etapa == "mayor_70":
             # Más paciencia y menos frecuencia para adultos mayores
-            estrategia_base["tiempo_respuesta_seg"] *= 1.5
-        elif perfil.etapa == "joven":
+            tiempo_respuesta *= 1.5
+        elif etapa == "joven":
             # Respuesta más rápida para jóvenes
-            estrategia_base["tiempo_respuesta_seg"] *= 0.7
+            tiempo_respuesta *= 0.7
         
-        return estrategia_base
+        return Regla(decision, estrategia, prioridad, tiempo_respuesta)
     
     def _validar_estrategia(
         self, 
-        estrategia: Dict, 
+        regla: Regla, 
         perfil: PerfilUsuario, 
         hora_actual: str
     ) -> Dict[str, Any]:
-        """Valida y ajusta la estrategia final"""
-        
-        # Asegurar campos requeridos
-        if "decision" not in estrategia:
-            estrategia["decision"] = DecisionOrquestador.ESPERAR
-        if "estrategia" not in estrategia:
-            estrategia["estrategia"] = TipoEstrategia.NEUTRAL
-        
-        # Ajuste por modo de comunicación
-        estrategia["modo_comunicacion"] = perfil.modo_comunicacion
-        
-        # Añadir timestamp
-        estrategia["timestamp"] = datetime.utcnow()
-        
-        return estrategia
+        """Construye la estrategia final a partir de la regla ajustada"""
+        return {
+            "decision": regla.decision,
+            "estrategia": regla.estrategia,
+            "prioridad": regla.prioridad,
+            "tiempo_respuesta_seg": regla.tiempo_respuesta_seg,
+            # Ajuste por modo de comunicación
+            "modo_comunicacion": perfil.modo_comunicacion,
+            "timestamp": time_ns()
+        }
     
     def _estrategia_fallback(self) -> Dict[str, Any]:
         """Estrategia de fallback en caso de errores"""
-        return {
-            "decision": DecisionOrquestador.ESPERAR,
-            "estrategia": TipoEstrategia.NEUTRAL,
-            "prioridad": "baja",
-            "tiempo_respuesta_seg": 600,
-            "razon": "Estrategia de fallback por error"
-        }
+        return dict(_ESTRATEGIA_FALLBACK)
     
     def _es_hora_silencio(self, hora_actual: str) -> bool:
         """Determina si es hora de silencio"""
         try:
-            hora, minuto = map(int, hora_actual.split(':'))
-            hora_decimal = hora + minuto / 60
+            hora, _, minuto = hora_actual.partition(':')
+            minutos = int(hora) * 60 + int(minuto)
             
             # Silencio: madrugada (22:00-06:00) y hora de comida (13:30-15:00)
-            return ((hora_decimal >= 22 or hora_decimal <= 6) or 
-                    (13.5 <= hora_decimal <= 15))
+            return ((minutos >= 1320 or minutos <= 360) or 
+                    (810 <= minutos <= 900))
         except ValueError:
             return False
     
     def _detectar_patron_repetitivo(self, contexto_previo: List[Dict[str, str]]) -> bool:
         """Detecta si hay patrones repetitivos en la conversación"""
-        if len(contexto_previo) < 3:
+        total = len(contexto_previo)
+        if total < 3:
             return False
         
-        # Simplificado: detectar respuestas muy similares
-        ultimas_respuestas = [msg.get("respuesta_sistema", "") for msg in contexto_previo[-3:]]
-        
-        # Si las respuestas son muy cortas y similares, posible patrón repetitivo
-        if all(len(resp) < 50 for resp in ultimas_respuestas):
-            return True
+        # Simplificado: si las 3 últimas respuestas son muy cortas, posible patrón repetitivo.
+        # Se recorren de la más reciente hacia atrás y se corta en la primera larga.
+        for i in range(total - 1, total - 4, -1):
+            if len(contexto_previo[i].get("respuesta_sistema", "")) >= 50:
+                return False
         
-        return False
+        return True
 
 
 # Instancia global del orquestador
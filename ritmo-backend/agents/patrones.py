@@ -10,6 +10,12 @@ from models.schemas import SenalesWeb, PerfilUsuario, EstadoInferido
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+# Minutos del día (0-1439) apropiados para rutinas: 08:00-12:00 y 14:00-18:00
+_MINUTOS_RUTINA = bytes(
+    480 <= minuto <= 720 or 840 <= minuto <= 1080
+    for minuto in range(24 * 60)
+)
+
 
 def inferir_estado(señales: SenalesWeb, perfil: PerfilUsuario) -> EstadoInferido:
     """
@@ -22,34 +28,26 @@ def inferir_estado(señales: SenalesWeb, perfil: PerfilUsuario) -> EstadoInferid
     Returns:
         EstadoInferido: Estado inferido con nivel de confianza y señales detectadas
     """
-    try:
-        # Inicializar sistema de puntuación
-        puntos = 0
-        señales_detectadas = []
-        
-        # Aplicar reglas de puntuación
-        puntos, señales_detectadas = _aplicar_reglas_puntuacion(señales, puntos, señales_detectadas)
-        
-        # Determinar estado basado en puntuación
-        estado = _determinar_estado(puntos, señales)
-        
-        # Determinar nivel de confianza
-        confianza = _determinar_confianza(señales)
-        
-        # Determinar recomendación para orquestador
-        recomendacion = _determinar_recomendacion(puntos, señales)
-        
-        logger.info(f"Pattern analysis completed: {estado} (confidence: {confianza}, points: {puntos})")
-        
-        return EstadoInferido(
-            estado=estado,
-            confianza=confianza,
-            señales_detectadas=señales_detectadas
-        )
-        
-    except Exception as e:
-        logger.error(f"Error inferring user state: {e}")
-        raise
+    # Inicializar sistema de puntuación
+    puntos = 0
+    señales_detectadas = []
+    
+    # Aplicar reglas de puntuación
+    puntos, señales_detectadas = _aplicar_reglas_puntuacion(señales, puntos, señales_detectadas)
+    
+    # Determinar estado basado en puntuación
+    estado = _determinar_estado(puntos, señales)
+    
+    # Determinar nivel de confianza
+    confianza = _determinar_confianza(señales)
+    
+    logger.info("Pattern analysis completed: %s (confidence: %s, points: %d)", estado, confianza, puntos)
+    
+    return EstadoInferido(
+        estado=estado,
+        confianza=confianza,
+        señales_detectadas=señales_detectadas
+    )
 
 
 def _aplicar_reglas_puntuacion(señales: SenalesWeb, puntos: int, señales_detectadas: List[str]) -> Tuple[int, List[str]]:
@@ -178,11 +176,11 @@ def _es_hora_de_rutina(hora_acceso: str) -> bool:
         bool: True si es hora apropiada para rutinas
     """
     try:
-        hora, minuto = map(int, hora_acceso.split(':'))
-        hora_decimal = hora + minuto / 60
+        hora, _, minuto = hora_acceso.partition(':')
+        minutos = int(hora) * 60 + int(minuto)
         
         # Horarios apropiados para rutinas (mañana y primera tarde)
-        return (8 <= hora_decimal <= 12) or (14 <= hora_decimal <= 18)
+        return 0 <= minutos < 1440 and bool(_MINUTOS_RUTINA[minutos])
         
     except ValueError:
         # Si no se puede parsear la hora, default a esperar
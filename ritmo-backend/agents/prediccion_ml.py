@@ -7,9 +7,14 @@ Conecta la funcionalidad ML del telegram-bot con el backend principal
 import logging
 from typing import Optional, Dict, List, Tuple
 import os
+import hashlib
+import time
+from functools import cache, lru_cache
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from models.schemas import PrediccionRiesgo, PerfilUsuario
 from db.sesiones import obtener_historial_usuario
@@ -43,16 +48,81 @@ except Exception as e:
     logger.warning(f"Unexpected error loading ML modules: {e}. Using fallback predictions.")
     ML_DISPONIBLE = False
 
+# Caché de predicciones ML por (usuario, mensaje): vigencia y tamaño máximo
+PREDICCION_CACHE_TTL_SEG = 60
+PREDICCION_CACHE_MAX = 256
+
+# Pool compartido para scaler.transform/predict_proba fuera del event loop
+_ML_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="ritmo-ml")
+
+# Máximo de usuarios con análisis de patrones históricos cacheado
+PATRONES_CACHE_MAX = 1024
+
+# Multiplicadores de la probabilidad ML según tendencia y nivel de alerta históricos
+_FACTOR_PATRON = {
+    "empeorando": 1.3,
+    "estable": 1.0,
+    "mejorando": 0.7,
+    "neutral": 1.0
+}
+_FACTOR_ALERTA = {
+    "critico": 1.5,
+    "preocupante": 1.2,
+    "atencion": 1.0,
+    "normal": 0.8
+}
+
+# Palabras clave de las características básicas del mensaje
+_PALABRAS_RIESGO_BASICAS = frozenset(("mal", "terrible", "no puedo", "ayuda", "solo", "triste", "morir"))
+_PALABRAS_POSITIVAS_BASICAS = frozenset(("bien", "mejor", "feliz", "gracias", "genial"))
+
+# Palabras clave del análisis básico de patrones históricos
+_PALABRAS_HISTORIAL_NEGATIVAS = frozenset(("mal", "triste", "difícil", "cansado"))
+_PALABRAS_HISTORIAL_POSITIVAS = frozenset(("bien", "mejor", "feliz", "genial"))
+
+# Palabras clave de los factores de riesgo del mensaje actual
+_PALABRAS_FACTOR_CRISIS = frozenset(("no puedo", "terrible", "desesperado"))
+_PALABRAS_FACTOR_AISLAMIENTO = frozenset(("solo", "nadie", "aislado"))
+_PALABRAS_FACTOR_CANSANCIO = frozenset(("cansado", "agotado", "sin_energia"))
+
+# Incremento de riesgo heurístico por etapa de vida
+_FACTORES_ETAPA_HEURISTICA = {
+    "mayor_70": 0.1,
+    "migrante": 0.15,
+    "discapacidad_visual": 0.1
+}
+
+# Palabras clave de la predicción heurística
+_PALABRAS_HEURISTICA_CRITICAS = frozenset(("suicidio", "morir", "acabar", "no puedo más"))
+_PALABRAS_HEURISTICA_RIESGO = frozenset(("mal", "terrible", "desesperado", "solo", "triste"))
+
 
 class PredictorRiesgoML:
     """Predictor de riesgo usando modelos ML entrenados"""
     
+    __slots__ = (
+        "modelo_cargado",
+        "modelo",
+        "scaler",
+        "motor_analisis",
+        "_cache_predicciones",
+        "_probabilidad_cacheada",
+        "_cache_patrones"
+    )
+    
     def __init__(self):
         self.modelo_cargado = False
         self.modelo = None
         self.scaler = None
         self.motor_analisis = None
         
+        # Predicciones recientes: (user_id, etapa, hash del mensaje) -> (instante, predicción)
+        self._cache_predicciones: Dict[Tuple[str, str, bytes], Tuple[float, PrediccionRiesgo]] = {}
+        # Memoización de la probabilidad del modelo por vector de características
+        self._probabilidad_cacheada = lru_cache(maxsize=512)(self._predecir_desde_bytes)
+        # Análisis de patrones por usuario: user_id -> (huella del historial, análisis)
+        self._cache_patrones: "OrderedDict[str, Tuple[Tuple, Dict]]" = OrderedDict()
+        
         if ML_DISPONIBLE:
             self._inicializar_modelo()
     
@@ -96,9 +166,21 @@ class PredictorRiesgoML:
         Returns:
             PrediccionRiesgo o None si no se puede predecir
         """
+        # Minúsculas una sola vez; los helpers de palabras clave reciben el texto ya convertido
+        mensaje_lower = mensaje_actual.lower()
+        
         try:
             if not self.modelo_cargado:
-                return await self._prediccion_heuristica(mensaje_actual, perfil)
+                return await self._prediccion_heuristica(mensaje_lower, perfil)
+            
+            clave_cache = (
+                user_id,
+                perfil.etapa,
+                hashlib.blake2b(mensaje_actual.encode(), digest_size=8).digest()
+            )
+            prediccion_cacheada = self._obtener_prediccion_cacheada(clave_cache)
+            if prediccion_cacheada is not None:
+                return prediccion_cacheada
             
             logger.info(f"Generating ML risk prediction for user: {user_id}")
             
@@ -113,27 +195,114 @@ class PredictorRiesgoML:
                 historial=historial
             )
             
-            # 3. Realizar predicción ML
-            probabilidad_riesgo = self._predecir_con_modelo(caracteristicas)
+            # 3. Realizar predicción ML (en el pool para no bloquear el event loop)
+            probabilidad_riesgo = await asyncio.get_running_loop().run_in_executor(
+                _ML_EXECUTOR, self._predecir_con_modelo, caracteristicas
+            )
             
             # 4. Analizar patrones históricos
-            analisis_patrones = await self._analizar_patrones_historicos(historial)
+            analisis_patrones = await self._analizar_patrones_historicos(historial, user_id)
             
             # 5. Combinar predicción ML con análisis de patrones
             prediccion_final = self._combinar_predicciones(
                 probabilidad_riesgo,
                 analisis_patrones,
-                mensaje_actual
+                mensaje_lower
             )
             
             logger.info(f"Risk prediction completed: {prediccion_final.nivel_riesgo} "
                        f"(probability: {prediccion_final.probabilidad_riesgo:.2f})")
             
+            self._guardar_prediccion_cacheada(clave_cache, prediccion_final)
             return prediccion_final
             
         except Exception as e:
             logger.error(f"Error in ML risk prediction: {e}")
-            return await self._prediccion_heuristica(mensaje_actual, perfil)
+            return await self._prediccion_heuristica(mensaje_lower, perfil)
+    
+    async def predecir_riesgo_batch(
+        self,
+        items: List[Tuple[str, str, PerfilUsuario]]
+    ) -> List[Optional[PrediccionRiesgo]]:
+        """
+        Genera predicciones de riesgo para varios mensajes con una sola llamada al modelo
+        
+        Args:
+            items: Lista de tuplas (user_id, mensaje, perfil)
+            
+        Returns:
+            Lista de PrediccionRiesgo en el mismo orden que items
+        """
+        mensajes_lower = [mensaje.lower() for _, mensaje, _ in items]
+        
+        try:
+            if not self.modelo_cargado or not items:
+                return [
+                    await self._prediccion_heuristica(mensaje_lower, perfil)
+                    for mensaje_lower, (_, _, perfil) in zip(mensajes_lower, items)
+                ]
+            
+            logger.info(f"Generating batch ML risk prediction for {len(items)} messages")
+            
+            # 1. Obtener historiales en paralelo
+            historiales = await asyncio.gather(*(
+                obtener_historial_usuario(user_id, dias_atras=30) for user_id, _, _ in items
+            ))
+            
+            # 2. Extraer características y apilarlas en una matriz (N, F)
+            caracteristicas = np.vstack([
+                await self._extraer_caracteristicas_ml(
+                    usuario_id=user_id,
+                    mensaje_actual=mensaje,
+                    perfil=perfil,
+                    historial=historial
+                )
+                for (user_id, mensaje, perfil), historial in zip(items, historiales)
+            ])
+            
+            # 3. Una única predicción ML para todo el lote
+            probabilidades = await asyncio.get_running_loop().run_in_executor(
+                _ML_EXECUTOR, self._predecir_lote_con_modelo, caracteristicas
+            )
+            
+            # 4-5. Analizar patrones y combinar por mensaje
+            predicciones = []
+            for probabilidad, historial, mensaje_lower, (user_id, _, _) in zip(
+                probabilidades, historiales, mensajes_lower, items
+            ):
+                analisis_patrones = await self._analizar_patrones_historicos(historial, user_id)
+                predicciones.append(
+                    self._combinar_predicciones(float(probabilidad), analisis_patrones, mensaje_lower)
+                )
+            
+            return predicciones
+            
+        except Exception as e:
+            logger.error(f"Error in batch ML risk prediction: {e}")
+            return [
+                await self._prediccion_heuristica(mensaje_lower, perfil)
+                for mensaje_lower, (_, _, perfil) in zip(mensajes_lower, items)
+            ]
+    
+    def _obtener_prediccion_cacheada(self, clave: Tuple[str, str, bytes]) -> Optional[PrediccionRiesgo]:
+        """Devuelve la predicción cacheada si sigue vigente"""
+        entrada = self._cache_predicciones.get(clave)
+        if entrada is None:
+            return None
+        
+        instante, prediccion = entrada
+        if time.monotonic() - instante > PREDICCION_CACHE_TTL_SEG:
+            del self._cache_predicciones[clave]
+            return None
+        
+        return prediccion
+    
+    def _guardar_prediccion_cacheada(self, clave: Tuple[str, str, bytes], prediccion: PrediccionRiesgo):
+        """Guarda la predicción descartando la entrada más antigua si la caché está llena"""
+        self._cache_predicciones.pop(clave, None)
+        if len(self._cache_predicciones) >= PREDICCION_CACHE_MAX:
+            del self._cache_predicciones[next(iter(self._cache_predicciones))]
+        self._cache_predicciones[clave] = (time.monotonic(), prediccion)
     
     async def _extraer_caracteristicas_ml(
         self,
@@ -152,7 +321,8 @@ class PredictorRiesgoML:
                     historial_checkins=historial,
                     perfil_usuario=perfil
                 )
-                return np.array(caracteristicas).reshape(1, -1)
+                # asarray no copia si ya es un ndarray float64; reshape devuelve una vista
+                return np.asarray(caracteristicas, dtype=np.float64).reshape(1, -1)
             
             # Fallback: características básicas manuales
             return self._extraer_caracteristicas_basicas(mensaje_actual, historial, perfil)
@@ -173,15 +343,15 @@ class PredictorRiesgoML:
         mensaje_lower = mensaje.lower()
         
         # Características del mensaje (0-1)
-        palabras_riesgo = ["mal", "terrible", "no puedo", "ayuda", "solo", "triste", "morir"]
-        palabras_positivas = ["bien", "mejor", "feliz", "gracias", "genial"]
-        
-        puntuacion_riesgo = sum(1 for palabra in palabras_riesgo if palabra in mensaje_lower)
-        puntuacion_positiva = sum(1 for palabra in palabras_positivas if palabra in mensaje_lower)
+        puntuacion_riesgo = sum(1 for palabra in _PALABRAS_RIESGO_BASICAS if palabra in mensaje_lower)
+        puntuacion_positiva = sum(1 for palabra in _PALABRAS_POSITIVAS_BASICAS if palabra in mensaje_lower)
         
         # Características del historial
         total_mensajes = len(historial)
-        mensajes_recientes = len([m for m in historial if self._es_reciente(m.get("timestamp", ""))])
+        limite_reciente = datetime.now(timezone.utc) - timedelta(hours=24)
+        mensajes_recientes = sum(
+            1 for m in historial if self._es_reciente(m.get("timestamp", ""), limite_reciente)
+        )
         
         # Características del perfil
         factor_etapa = {
@@ -207,7 +377,13 @@ class PredictorRiesgoML:
         return np.array(caracteristicas).reshape(1, -1)
     
     def _predecir_con_modelo(self, caracteristicas: np.ndarray) -> float:
-        """Realiza predicción usando el modelo ML cargado"""
+        """Realiza predicción usando el modelo ML cargado (memoizada por vector)"""
+        caracteristicas = np.ascontiguousarray(caracteristicas, dtype=np.float64)
+        return self._probabilidad_cacheada(caracteristicas.tobytes(), caracteristicas.shape[1])
+    
+    def _predecir_desde_bytes(self, datos: bytes, num_caracteristicas: int) -> float:
+        """Reconstruye el vector de características y realiza la predicción"""
+        caracteristicas = np.frombuffer(datos, dtype=np.float64).reshape(-1, num_caracteristicas)
         
         try:
             # Normalizar características
@@ -223,12 +399,57 @@ class PredictorRiesgoML:
             # Fallback: cálculo básico heurístico
             return float(np.mean(caracteristicas[0][:3]))  # Promedio de características de riesgo
     
-    async def _analizar_patrones_historicos(self, historial: List[Dict]) -> Dict:
-        """Analiza patrones en el historial del usuario"""
+    def _predecir_lote_con_modelo(self, caracteristicas: np.ndarray) -> np.ndarray:
+        """Realiza la predicción de un lote (N, F) con una sola llamada al modelo"""
+        
+        try:
+            caracteristicas_normalizadas = self.scaler.transform(caracteristicas)
+            return self.modelo.predict_proba(caracteristicas_normalizadas)[:, 1]
+            
+        except Exception as e:
+            logger.error(f"Error in batch ML prediction: {e}")
+            # Fallback: promedio de las características de riesgo de cada fila
+            return np.mean(caracteristicas[:, :3], axis=1)
+    
+    async def _analizar_patrones_historicos(
+        self,
+        historial: List[Dict],
+        user_id: Optional[str] = None
+    ) -> Dict:
+        """
+        Analiza patrones en el historial del usuario
+        
+        Args:
+            historial: Historial del usuario
+            user_id: ID del usuario; si se indica, el análisis se cachea mientras el historial no cambie
+            
+        Returns:
+            Dict con tendencia, nivel de alerta y racha negativa
+        """
         
         if not historial:
             return {"patron_tendencia": "neutral", "nivel_alerta": "normal"}
         
+        if user_id is None:
+            return self._calcular_patrones_historicos(historial)
+        
+        huella = _huella_historial(historial)
+        entrada = self._cache_patrones.get(user_id)
+        if entrada is not None and entrada[0] == huella:
+            self._cache_patrones.move_to_end(user_id)
+            return dict(entrada[1])
+        
+        analisis = self._calcular_patrones_historicos(historial)
+        self._cache_patrones[user_id] = (huella, analisis)
+        self._cache_patrones.move_to_end(user_id)
+        if len(self._cache_patrones) > PATRONES_CACHE_MAX:
+            self._cache_patrones.popitem(last=False)
+        
+        return dict(analisis)
+    
+    def _calcular_patrones_historicos(self, historial: List[Dict]) -> Dict:
+        """Calcula el análisis de patrones históricos sin caché"""
+        
         try:
             if ML_DISPONIBLE and self.motor_analisis:
                 # Usar motor de análisis del telegram-bot
@@ -257,9 +478,9 @@ class PredictorRiesgoML:
         
         for mensaje in historial[-10:]:  # Últimos 10 mensajes
             texto = mensaje.get("mensaje_usuario", "").lower()
-            if any(palabra in texto for palabra in ["mal", "triste", "difícil", "cansado"]):
+            if any(palabra in texto for palabra in _PALABRAS_HISTORIAL_NEGATIVAS):
                 mensajes_negativos += 1
-            elif any(palabra in texto for palabra in ["bien", "mejor", "feliz", "genial"]):
+            elif any(palabra in texto for palabra in _PALABRAS_HISTORIAL_POSITIVAS):
                 mensajes_positivos += 1
         
         # Determinar tendencia
@@ -283,24 +504,13 @@ class PredictorRiesgoML:
         self,
         probabilidad_ml: float,
         patrones_historicos: Dict,
-        mensaje_actual: str
+        mensaje_lower: str
     ) -> PrediccionRiesgo:
         """Combina predicción ML con análisis de patrones"""
         
         # Ajustar probabilidad según patrones históricos
-        factor_patron = {
-            "empeorando": 1.3,
-            "estable": 1.0,
-            "mejorando": 0.7,
-            "neutral": 1.0
-        }.get(patrones_historicos.get("patron_tendencia", "neutral"), 1.0)
-        
-        factor_alerta = {
-            "critico": 1.5,
-            "preocupante": 1.2,
-            "atencion": 1.0,
-            "normal": 0.8
-        }.get(patrones_historicos.get("nivel_alerta", "normal"), 1.0)
+        factor_patron = _FACTOR_PATRON.get(patrones_historicos.get("patron_tendencia", "neutral"), 1.0)
+        factor_alerta = _FACTOR_ALERTA.get(patrones_historicos.get("nivel_alerta", "normal"), 1.0)
         
         # Probabilidad ajustada
         probabilidad_ajustada = min(probabilidad_ml * factor_patron * factor_alerta, 1.0)
@@ -317,7 +527,7 @@ class PredictorRiesgoML:
         
         # Identificar factores de riesgo
         factores_riesgo = self._identificar_factores_riesgo(
-            mensaje_actual, patrones_historicos, probabilidad_ajustada
+            mensaje_lower, patrones_historicos, probabilidad_ajustada
         )
         
         # Calcular confianza del modelo
@@ -332,23 +542,22 @@ class PredictorRiesgoML:
     
     def _identificar_factores_riesgo(
         self,
-        mensaje: str,
+        mensaje_lower: str,
         patrones: Dict,
         probabilidad: float
     ) -> List[str]:
         """Identifica factores específicos que contribuyen al riesgo"""
         
         factores = []
-        mensaje_lower = mensaje.lower()
         
         # Factores del mensaje actual
-        if any(palabra in mensaje_lower for palabra in ["no puedo", "terrible", "desesperado"]):
+        if any(palabra in mensaje_lower for palabra in _PALABRAS_FACTOR_CRISIS):
             factores.append("lenguaje_crisis")
         
-        if any(palabra in mensaje_lower for palabra in ["solo", "nadie", "aislado"]):
+        if any(palabra in mensaje_lower for palabra in _PALABRAS_FACTOR_AISLAMIENTO):
             factores.append("aislamiento_social")
         
-        if any(palabra in mensaje_lower for palabra in ["cansado", "agotado", "sin_energia"]):
+        if any(palabra in mensaje_lower for palabra in _PALABRAS_FACTOR_CANSANCIO):
             factores.append("cansancio_extremo")
         
         # Factores de patrones históricos
@@ -366,34 +575,27 @@ class PredictorRiesgoML:
     
     async def _prediccion_heuristica(
         self, 
-        mensaje: str, 
+        mensaje_lower: str, 
         perfil: PerfilUsuario
     ) -> PrediccionRiesgo:
-        """Predicción heurística básica cuando ML no está disponible"""
+        """Predicción heurística básica cuando ML no está disponible (mensaje ya en minúsculas)"""
         
-        mensaje_lower = mensaje.lower()
         puntuacion_riesgo = 0
         factores = []
         
         # Palabras de alto riesgo
-        palabras_criticas = ["suicidio", "morir", "acabar", "no puedo más"]
-        if any(palabra in mensaje_lower for palabra in palabras_criticas):
+        if any(palabra in mensaje_lower for palabra in _PALABRAS_HEURISTICA_CRITICAS):
             puntuacion_riesgo += 0.8
             factores.append("lenguaje_crisis")
         
-        # Palabras de riesgo medio
-        palabras_riesgo = ["mal", "terrible", "desesperado", "solo", "triste"]
-        puntuacion_riesgo += sum(0.2 for palabra in palabras_riesgo if palabra in mensaje_lower)
+        # Palabras de riesgo medio (0.2 por palabra; se cuentan como enteros)
+        coincidencias = sum(palabra in mensaje_lower for palabra in _PALABRAS_HEURISTICA_RIESGO)
+        puntuacion_riesgo += coincidencias * 0.2
         if puntuacion_riesgo > 0.2:
             factores.append("emociones_negativas")
         
         # Ajustar por etapa de vida
-        factores_etapa = {
-            "mayor_70": 0.1,
-            "migrante": 0.15,
-            "discapacidad_visual": 0.1
-        }
-        puntuacion_riesgo += factores_etapa.get(perfil.etapa, 0)
+        puntuacion_riesgo += _FACTORES_ETAPA_HEURISTICA.get(perfil.etapa, 0)
         
         # Limitar a 1.0
         puntuacion_riesgo = min(puntuacion_riesgo, 1.0)
@@ -413,23 +615,92 @@ class PredictorRiesgoML:
             confianza_modelo=0.5  # Confianza baja para predicción heurística
         )
     
-    def _es_reciente(self, timestamp_str: str, horas: int = 24) -> bool:
-        """Determina si un timestamp es reciente"""
+    def _es_reciente(self, timestamp_str: str, limite: datetime) -> bool:
+        """
+        Determina si un timestamp es reciente
+        
+        Args:
+            timestamp_str: Timestamp en formato ISO
+            limite: Instante (UTC) a partir del cual se considera reciente; se calcula
+                una vez por pasada sobre el historial
+                
+        Returns:
+            bool: True si el timestamp es posterior o igual al límite
+        """
         try:
             if isinstance(timestamp_str, str):
                 timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
             else:
                 return False
             
-            limite = datetime.utcnow() - timedelta(hours=horas)
+            # Timestamps sin zona horaria se interpretan como UTC
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            
             return timestamp >= limite
             
         except Exception:
             return False
 
 
-# Instancia global del predictor
-predictor_riesgo = PredictorRiesgoML()
+def _huella_historial(historial) -> Tuple:
+    """
+    Huella barata del historial: longitud y timestamps de los extremos
+    
+    Args:
+        historial: Lista de registros o dict de listas por tipo de registro
+        
+    Returns:
+        Tuple que cambia cuando se añaden o eliminan registros
+    """
+    if isinstance(historial, dict):
+        return tuple((clave, _huella_historial(registros)) for clave, registros in historial.items())
+    
+    if not historial:
+        return (0,)
+    
+    primero, ultimo = historial[0], historial[-1]
+    return (
+        len(historial),
+        _instante_registro(primero),
+        _instante_registro(ultimo)
+    )
+
+
+def _instante_registro(registro) -> str:
+    """Timestamp de un registro; las filas de sesiones_web solo tienen hora_inicio"""
+    if not isinstance(registro, dict):
+        return registro
+    return registro.get("timestamp") or registro.get("hora_inicio") or ""
+
+
+@cache
+def get_predictor() -> PredictorRiesgoML:
+    """
+    Devuelve el predictor global, creándolo en el primer uso
+    
+    Returns:
+        PredictorRiesgoML compartido por todo el proceso
+    """
+    return PredictorRiesgoML()
+
+
+# Evita que dos peticiones concurrentes carguen (o entrenen) el modelo a la vez
+_predictor_lock = asyncio.Lock()
+_predictor_listo = False
+
+
+async def _obtener_predictor() -> PredictorRiesgoML:
+    """Obtiene el predictor global inicializándolo fuera del event loop la primera vez"""
+    global _predictor_listo
+    
+    if not _predictor_listo:
+        async with _predictor_lock:
+            if not _predictor_listo:
+                await asyncio.get_running_loop().run_in_executor(None, get_predictor)
+                _predictor_listo = True
+    
+    return get_predictor()
 
 
 async def predecir_riesgo(
@@ -448,4 +719,21 @@ async def predecir_riesgo(
     Returns:
         PrediccionRiesgo o None si no se puede predecir
     """
-    return await predictor_riesgo.predecir_riesgo_completo(user_id, mensaje, perfil)
\ No newline at end of file
+    predictor = await _obtener_predictor()
+    return await predictor.predecir_riesgo_completo(user_id, mensaje, perfil)
+
+
+async def predecir_riesgo_batch(
+    items: List[Tuple[str, str, PerfilUsuario]]
+) -> List[Optional[PrediccionRiesgo]]:
+    """
+    Función pública para predecir riesgo de varios mensajes a la vez
+    
+    Args:
+        items: Lista de tuplas (user_id, mensaje, perfil)
+        
+    Returns:
+        Lista de PrediccionRiesgo en el mismo orden que items
+    """
+    predictor = await _obtener_predictor()
+    return await predictor.predecir_riesgo_batch(items)
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""
+Configuración de RITMO Backend
+Lee el entorno (y el archivo .env) una sola vez por proceso
+"""
+
+import os
+from dataclasses import dataclass
+from functools import cache
+from typing import Optional
+
+from dotenv import load_dotenv
+
+# Cargar variables de entorno antes de que otros módulos las consulten
+load_dotenv()
+
+
+@dataclass(frozen=True, slots=True)
+class Configuracion:
+    """Configuración inmutable del servidor"""
+    supabase_url: Optional[str]
+    supabase_key: Optional[str]
+    supabase_configurado: bool
+
+
+@cache
+def get_configuracion() -> Configuracion:
+    """
+    Obtiene la configuración del servidor, leída del entorno en la primera llamada
+
+    Returns:
+        Configuracion: Configuración compartida por todo el proceso
+    """
+    url = os.getenv("SUPABASE_URL") or None
+    key = os.getenv("SUPABASE_KEY") or None
+    return Configuracion(
+        supabase_url=url,
+        supabase_key=key,
+        supabase_configurado=bool(url and key)
+    )
@@ -1,12 +1,93 @@
+import asyncio
 import logging
-from datetime import datetime
+import httpx
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, Optional, List
-from db.supabase_client import get_supabase_client
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+from db.supabase_client import ejecutar_consulta, get_supabase_client
 from models.schemas import SenalesWeb
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+# Columnas que se leen de cada tabla (el resto no lo usa ningún consumidor)
+_SESION_COLS = 'hora_inicio, hora_fin, duracion_seg, hora_local, dia_semana, es_madrugada'
+_CHAT_COLS = 'mensaje_usuario, respuesta_sistema, tono, timestamp'
+_EVENTO_COLS = 'tipo_evento, valor, timestamp'
+
+# Errores esperables al hablar con Supabase: respuesta de error de PostgREST, fallo HTTP
+# o cliente sin configurar (get_supabase_client lanza ValueError sin SUPABASE_URL/KEY)
+_ERRORES_SUPABASE = (APIError, httpx.HTTPError, ValueError)
+
+# Código de PostgREST cuando la función SQL invocada no existe
+_CODIGO_FUNCION_NO_ENCONTRADA = 'PGRST202'
+
+# Funciones SQL que ya se comprobó que no están desplegadas
+_rpc_no_disponibles: set = set()
+
+
+def _ahora_iso() -> str:
+    """Instante actual en UTC, en formato ISO con precisión de milisegundos"""
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+
+
+async def _ejecutar_rpc(client: Any, funcion: str, parametros: Dict[str, Any]) -> Optional[Any]:
+    """
+    Ejecuta una función SQL vía PostgREST si está desplegada en la base de datos
+    
+    Args:
+        client: Cliente Supabase
+        funcion: Nombre de la función SQL
+        parametros: Argumentos de la función
+        
+    Returns:
+        Respuesta de la consulta, o None si la función no existe
+    """
+    if funcion in _rpc_no_disponibles:
+        return None
+    
+    try:
+        return await ejecutar_consulta(client.rpc(funcion, parametros))
+    except APIError as e:
+        if e.code != _CODIGO_FUNCION_NO_ENCONTRADA:
+            raise
+        logger.warning("SQL function %s not found, using client-side fallback", funcion)
+        _rpc_no_disponibles.add(funcion)
+        return None
+
+
+async def contar_usuarios_unicos(client: Any, desde: str) -> int:
+    """
+    Cuenta los usuarios distintos con sesiones desde una fecha
+    
+    El conteo se hace en Postgres con la función:
+    
+        CREATE FUNCTION count_unique_users_since(since timestamptz) RETURNS bigint
+        LANGUAGE sql STABLE AS $$
+            SELECT COUNT(DISTINCT user_id) FROM sesiones_web WHERE hora_inicio >= since
+        $$;
+    
+    Si la función no está desplegada se descargan los user_id y se cuentan aquí.
+    
+    Args:
+        client: Cliente Supabase
+        desde: Fecha límite en formato ISO
+        
+    Returns:
+        Número de usuarios únicos
+    """
+    response = await _ejecutar_rpc(client, 'count_unique_users_since', {'since': desde})
+    if response is not None:
+        return response.data or 0
+    
+    response = await ejecutar_consulta(
+        client.table('sesiones_web')
+        .select('user_id')
+        .gte('hora_inicio', desde)
+    )
+    return len(set(sesion['user_id'] for sesion in response.data)) if response.data else 0
+
 
 async def guardar_sesion(user_id: str, señales: SenalesWeb) -> Optional[Dict[str, Any]]:
     """
@@ -20,35 +101,36 @@ async def guardar_sesion(user_id: str, señales: SenalesWeb) -> Optional[Dict[st
         Dict con los datos guardados o None si hubo error
         
     Raises:
-        Exception: Si hay error en la inserción
+        APIError, httpx.HTTPError, ValueError: Si hay error en la inserción o no hay cliente
     """
     try:
         client = get_supabase_client()
+        ahora = _ahora_iso()
         
         # Preparar datos para inserción
         session_data = {
             'user_id': user_id,
-            'hora_inicio': datetime.utcnow().isoformat(),
+            'hora_inicio': ahora,
             'hora_fin': None,  # Se actualizará cuando termine la sesión
             'duracion_seg': señales.duracion_sesion_anterior_seg,
             'hora_local': señales.hora_acceso,
             'dia_semana': señales.dia_semana,
             'es_madrugada': señales.es_madrugada,
-            'created_at': datetime.utcnow().isoformat()
+            'created_at': ahora
         }
         
         # Insertar en Supabase
-        response = client.table('sesiones_web').insert(session_data).execute()
+        response = await ejecutar_consulta(client.table('sesiones_web').insert(session_data))
         
         if response.data:
-            logger.info(f"Session saved successfully for user {user_id}")
+            logger.info("Session saved successfully for user %s", user_id)
             return response.data[0]
         else:
-            logger.error(f"Failed to save session for user {user_id}: No data returned")
+            logger.error("Failed to save session for user %s: No data returned", user_id)
             return None
             
-    except Exception as e:
-        logger.error(f"Error saving session for user {user_id}: {e}")
+    except _ERRORES_SUPABASE as e:
+        logger.error("Error saving session for user %s: %s", user_id, e)
         raise
 
 
@@ -65,7 +147,7 @@ async def guardar_evento(user_id: str, tipo_evento: str, valor: str) -> Optional
         Dict con los datos guardados o None si hubo error
         
     Raises:
-        Exception: Si hay error en la inserción
+        APIError, httpx.HTTPError, ValueError: Si hay error en la inserción o no hay cliente
     """
     try:
         client = get_supabase_client()
@@ -75,21 +157,21 @@ async def guardar_evento(user_id: str, tipo_evento: str, valor: str) -> Optional
             'user_id': user_id,
             'tipo_evento': tipo_evento,
             'valor': valor,
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': _ahora_iso()
         }
         
         # Insertar en Supabase
-        response = client.table('eventos_comportamiento').insert(event_data).execute()
+        response = await ejecutar_consulta(client.table('eventos_comportamiento').insert(event_data))
         
         if response.data:
-            logger.info(f"Event saved successfully: {tipo_evento} for user {user_id}")
+            logger.info("Event saved successfully: %s for user %s", tipo_evento, user_id)
             return response.data[0]
         else:
-            logger.error(f"Failed to save event {tipo_evento} for user {user_id}: No data returned")
+            logger.error("Failed to save event %s for user %s: No data returned", tipo_evento, user_id)
             return None
             
-    except Exception as e:
-        logger.error(f"Error saving event {tipo_evento} for user {user_id}: {e}")
+    except _ERRORES_SUPABASE as e:
+        logger.error("Error saving event %s for user %s: %s", tipo_evento, user_id, e)
         raise
 
 
@@ -104,45 +186,55 @@ async def guardar_eventos_señales(user_id: str, señales: SenalesWeb) -> bool:
     Returns:
         bool: True si todos los eventos se guardaron correctamente
     """
-    try:
-        eventos_guardados = 0
-        
-        # Evento de acceso en madrugada
-        if señales.es_madrugada:
-            await guardar_evento(user_id, "acceso_madrugada", señales.hora_acceso)
-            eventos_guardados += 1
-        
-        # Evento de tiempo de respuesta alto
-        if señales.tiempo_respuesta_usuario_seg > 300:
-            await guardar_evento(user_id, "tiempo_respuesta_alto", str(señales.tiempo_respuesta_usuario_seg))
-            eventos_guardados += 1
-        
-        # Evento de días sin registrar
-        if señales.dias_sin_registrar > 0:
-            await guardar_evento(user_id, "dias_sin_actividad", str(señales.dias_sin_registrar))
-            eventos_guardados += 1
-        
-        # Evento de sesión corta
-        if señales.duracion_sesion_anterior_seg < 30:
-            await guardar_evento(user_id, "sesion_corta", str(señales.duracion_sesion_anterior_seg))
-            eventos_guardados += 1
-        
-        # Evento de frecuencia alta de accesos
-        if señales.frecuencia_accesos_hoy > 10:
-            await guardar_evento(user_id, "accesos_frecuentes", str(señales.frecuencia_accesos_hoy))
-            eventos_guardados += 1
-        
-        # Evento de checkin emocional
-        if señales.checkin_emocional:
-            await guardar_evento(user_id, "checkin_emocional", señales.checkin_emocional)
-            eventos_guardados += 1
-        
-        logger.info(f"Saved {eventos_guardados} behavioral events for user {user_id}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Error saving behavioral events for user {user_id}: {e}")
-        return False
+    timestamp = _ahora_iso()
+    eventos = []
+    
+    def _agregar_evento(tipo_evento: str, valor: str) -> None:
+        eventos.append({
+            'user_id': user_id,
+            'tipo_evento': tipo_evento,
+            'valor': valor,
+            'timestamp': timestamp
+        })
+    
+    # Evento de acceso en madrugada
+    if señales.es_madrugada:
+        _agregar_evento("acceso_madrugada", señales.hora_acceso)
+    
+    # Evento de tiempo de respuesta alto
+    if señales.tiempo_respuesta_usuario_seg > 300:
+        _agregar_evento("tiempo_respuesta_alto", str(señales.tiempo_respuesta_usuario_seg))
+    
+    # Evento de días sin registrar
+    if señales.dias_sin_registrar > 0:
+        _agregar_evento("dias_sin_actividad", str(señales.dias_sin_registrar))
+    
+    # Evento de sesión corta
+    if señales.duracion_sesion_anterior_seg < 30:
+        _agregar_evento("sesion_corta", str(señales.duracion_sesion_anterior_seg))
+    
+    # Evento de frecuencia alta de accesos
+    if señales.frecuencia_accesos_hoy > 10:
+        _agregar_evento("accesos_frecuentes", str(señales.frecuencia_accesos_hoy))
+    
+    # Evento de checkin emocional
+    if señales.checkin_emocional:
+        _agregar_evento("checkin_emocional", señales.checkin_emocional)
+    
+    # Una sola inserción para todos los eventos (atómica: todos o ninguno);
+    # las filas insertadas no se usan, así que PostgREST no las devuelve
+    if eventos:
+        try:
+            client = get_supabase_client()
+            await ejecutar_consulta(
+                client.table('eventos_comportamiento').insert(eventos, returning=ReturnMethod.minimal)
+            )
+        except _ERRORES_SUPABASE as e:
+            logger.error("Error saving behavioral events for user %s: %s", user_id, e)
+            return False
+    
+    logger.info("Saved %d behavioral events for user %s", len(eventos), user_id)
+    return True
 
 
 # === NUEVAS FUNCIONES PARA CHAT Y ML ===
@@ -151,7 +243,8 @@ async def guardar_mensaje(
     user_id: str, 
     mensaje_usuario: str, 
     respuesta_sistema: str, 
-    tono: str
+    tono: str,
+    timestamp: Optional[datetime] = None
 ) -> Optional[Dict[str, Any]]:
     """
     Guarda un intercambio de chat en la base de datos
@@ -161,6 +254,7 @@ async def guardar_mensaje(
         mensaje_usuario: Mensaje del usuario
         respuesta_sistema: Respuesta generada por el sistema
         tono: Tono de la respuesta
+        timestamp: Instante del intercambio; si no se indica, el actual
         
     Returns:
         Dict con los datos guardados o None si hubo error
@@ -174,34 +268,44 @@ async def guardar_mensaje(
             'mensaje_usuario': mensaje_usuario,
             'respuesta_sistema': respuesta_sistema,
             'tono': tono,
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': timestamp.isoformat(timespec='milliseconds') if timestamp else _ahora_iso()
         }
         
         # Insertar en Supabase
-        response = client.table('historial_chat').insert(chat_data).execute()
+        response = await ejecutar_consulta(client.table('historial_chat').insert(chat_data))
         
         if response.data:
-            logger.info(f"Chat message saved successfully for user {user_id}")
+            logger.info("Chat message saved successfully for user %s", user_id)
             return response.data[0]
         else:
-            logger.error(f"Failed to save chat message for user {user_id}: No data returned")
+            logger.error("Failed to save chat message for user %s: No data returned", user_id)
             return None
             
-    except Exception as e:
-        logger.error(f"Error saving chat message for user {user_id}: {e}")
+    except _ERRORES_SUPABASE as e:
+        logger.error("Error saving chat message for user %s: %s", user_id, e)
         return None
 
 
 async def obtener_historial_chat(
     user_id: str, 
-    limit: int = 10
+    limit: int = 10,
+    antes_de: Optional[str] = None
 ) -> List[Dict[str, str]]:
     """
     Obtiene el historial reciente de chat del usuario
     
+    La consulta se resuelve recorriendo el índice:
+    
+        CREATE INDEX CONCURRENTLY idx_historial_chat_user_ts
+            ON historial_chat (user_id, timestamp DESC);
+    
+    Para paginar hacia atrás se pasa como cursor el timestamp del mensaje más
+    antiguo ya obtenido, en vez de usar OFFSET.
+    
     Args:
         user_id: ID del usuario
         limit: Límite de mensajes a obtener
+        antes_de: Cursor opcional; solo se devuelven mensajes anteriores a este timestamp
         
     Returns:
         Lista de diccionarios con el historial de chat
@@ -209,23 +313,30 @@ async def obtener_historial_chat(
     try:
         client = get_supabase_client()
         
-        response = client.table('historial_chat') \
-            .select('mensaje_usuario, respuesta_sistema, tono, timestamp') \
-            .eq('user_id', user_id) \
-            .order('timestamp', desc=True) \
-            .limit(limit) \
-            .execute()
+        consulta = (
+            client.table('historial_chat')
+            .select(_CHAT_COLS)
+            .eq('user_id', user_id)
+        )
+        if antes_de is not None:
+            consulta = consulta.lt('timestamp', antes_de)
+        
+        response = await ejecutar_consulta(
+            consulta
+            .order('timestamp', desc=True)
+            .limit(limit)
+        )
         
         if response.data:
-            logger.info(f"Retrieved {len(response.data)} chat messages for user {user_id}")
+            logger.info("Retrieved %d chat messages for user %s", len(response.data), user_id)
             # Invertir orden para tener el más antiguo primero
             return list(reversed(response.data))
         else:
-            logger.info(f"No chat history found for user {user_id}")
+            logger.info("No chat history found for user %s", user_id)
             return []
             
-    except Exception as e:
-        logger.error(f"Error retrieving chat history for user {user_id}: {e}")
+    except _ERRORES_SUPABASE as e:
+        logger.error("Error retrieving chat history for user %s: %s", user_id, e)
         return []
 
 
@@ -236,6 +347,13 @@ async def obtener_historial_usuario(
     """
     Obtiene el historial completo del usuario para análisis ML
     
+    Cada consulta usa su índice (user_id, fecha DESC):
+    
+        CREATE INDEX CONCURRENTLY idx_sesiones_user_inicio
+            ON sesiones_web (user_id, hora_inicio DESC);
+        CREATE INDEX CONCURRENTLY idx_eventos_user_ts
+            ON eventos_comportamiento (user_id, timestamp DESC);
+    
     Args:
         user_id: ID del usuario
         dias_atras: Número de días hacia atrás
@@ -244,34 +362,37 @@ async def obtener_historial_usuario(
         Lista de diccionarios con todo el historial del usuario
     """
     try:
-        from datetime import timedelta
         client = get_supabase_client()
         
-        fecha_limite = datetime.utcnow() - timedelta(days=dias_atras)
-        
-        # Obtener sesiones
-        sesiones_response = client.table('sesiones_web') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .gte('hora_inicio', fecha_limite.isoformat()) \
-            .order('hora_inicio', desc=True) \
-            .execute()
-        
-        # Obtener mensajes de chat
-        chat_response = client.table('historial_chat') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .gte('timestamp', fecha_limite.isoformat()) \
-            .order('timestamp', desc=True) \
-            .execute()
-        
-        # Obtener eventos de comportamiento
-        eventos_response = client.table('eventos_comportamiento') \
-            .select('*') \
-            .eq('user_id', user_id) \
-            .gte('timestamp', fecha_limite.isoformat()) \
-            .order('timestamp', desc=True) \
-            .execute()
+        desde = (datetime.now(timezone.utc) - timedelta(days=dias_atras)).isoformat()
+        
+        # Las tres consultas son independientes: se lanzan a la vez
+        sesiones_response, chat_response, eventos_response = await asyncio.gather(
+            # Obtener sesiones
+            ejecutar_consulta(
+                client.table('sesiones_web')
+                .select(_SESION_COLS)
+                .eq('user_id', user_id)
+                .gte('hora_inicio', desde)
+                .order('hora_inicio', desc=True)
+            ),
+            # Obtener mensajes de chat
+            ejecutar_consulta(
+                client.table('historial_chat')
+                .select(_CHAT_COLS)
+                .eq('user_id', user_id)
+                .gte('timestamp', desde)
+                .order('timestamp', desc=True)
+            ),
+            # Obtener eventos de comportamiento
+            ejecutar_consulta(
+                client.table('eventos_comportamiento')
+                .select(_EVENTO_COLS)
+                .eq('user_id', user_id)
+                .gte('timestamp', desde)
+                .order('timestamp', desc=True)
+            )
+        )
         
         historial = {
             'sesiones': sesiones_response.data if sesiones_response.data else [],
@@ -279,64 +400,56 @@ async def obtener_historial_usuario(
             'eventos': eventos_response.data if eventos_response.data else []
         }
         
-        logger.info(f"Retrieved complete history for user {user_id}: "
-                   f"{len(historial['sesiones'])} sessions, "
-                   f"{len(historial['chat_messages'])} messages, "
-                   f"{len(historial['eventos'])} events")
+        logger.info(
+            "Retrieved complete history for user %s: %d sessions, %d messages, %d events",
+            user_id, len(historial['sesiones']), len(historial['chat_messages']), len(historial['eventos'])
+        )
         
         return historial
         
-    except Exception as e:
-        logger.error(f"Error retrieving user history for {user_id}: {e}")
+    except _ERRORES_SUPABASE as e:
+        logger.error("Error retrieving user history for %s: %s", user_id, e)
         return {'sesiones': [], 'chat_messages': [], 'eventos': []}
 
 
-async def obtener_estadisticas_uso(dias_atras: int = 7) -> Dict[str, Any]:
+async def obtener_agregados_admin(dias_atras: int = 7) -> Optional[Dict[str, Any]]:
     """
-    Obtiene estadísticas de uso del sistema para el panel admin
+    Calcula en Postgres los agregados de sesiones del panel admin
+    
+    Se resuelven en una sola fila con la función:
+    
+        CREATE FUNCTION admin_stats(p_since timestamptz, p_hoy timestamptz)
+        RETURNS TABLE (usuarios_activos bigint, sesiones_hoy bigint, duracion_promedio_seg numeric)
+        LANGUAGE sql STABLE AS $$
+            SELECT
+                COUNT(DISTINCT user_id) FILTER (WHERE hora_inicio >= p_since),
+                COUNT(*) FILTER (WHERE hora_inicio >= p_hoy),
+                AVG(duracion_seg) FILTER (WHERE hora_inicio >= p_since AND duracion_seg <> 0)
+            FROM sesiones_web
+            WHERE hora_inicio >= LEAST(p_since, p_hoy)
+        $$;
     
     Args:
-        dias_atras: Número de días hacia atrás para calcular estadísticas
+        dias_atras: Número de días hacia atrás para usuarios activos y duración media
         
     Returns:
-        Dict con estadísticas de uso
+        Dict con usuarios_activos, sesiones_hoy y duracion_promedio_seg, o None si la
+        función no está desplegada o la consulta falla
     """
     try:
-        from datetime import timedelta
         client = get_supabase_client()
         
-        fecha_limite = datetime.utcnow() - timedelta(days=dias_atras)
-        
-        # Contar sesiones totales
-        sesiones_response = client.table('sesiones_web') \
-            .select('*', count='exact') \
-            .gte('hora_inicio', fecha_limite.isoformat()) \
-            .execute()
-        
-        # Contar mensajes de chat
-        chat_response = client.table('historial_chat') \
-            .select('*', count='exact') \
-            .gte('timestamp', fecha_limite.isoformat()) \
-            .execute()
-        
-        # Contar usuarios únicos
-        usuarios_response = client.table('sesiones_web') \
-            .select('user_id') \
-            .gte('hora_inicio', fecha_limite.isoformat()) \
-            .execute()
-        
-        usuarios_unicos = len(set(sesion['user_id'] for sesion in usuarios_response.data)) if usuarios_response.data else 0
-        
-        estadisticas = {
-            'total_sesiones': sesiones_response.count if sesiones_response.count else 0,
-            'total_mensajes_chat': chat_response.count if chat_response.count else 0,
-            'usuarios_unicos': usuarios_unicos,
-            'periodo_dias': dias_atras
+        ahora = datetime.now(timezone.utc)
+        parametros = {
+            'p_since': (ahora - timedelta(days=dias_atras)).isoformat(),
+            'p_hoy': ahora.date().isoformat()
         }
         
-        logger.info(f"Generated usage statistics for last {dias_atras} days: {estadisticas}")
-        return estadisticas
+        response = await _ejecutar_rpc(client, 'admin_stats', parametros)
+        if response is None or not response.data:
+            return None
+        return response.data[0]
         
-    except Exception as e:
-        logger.error(f"Error generating usage statistics: {e}")
-        return {'total_sesiones': 0, 'total_mensajes_chat': 0, 'usuarios_unicos': 0, 'periodo_dias': dias_atras}
\ No newline at end of file
+    except _ERRORES_SUPABASE as e:
+        logger.error("Error computing admin aggregates: %s", e)
+        return None
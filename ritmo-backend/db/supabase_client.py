@@ -1,67 +1,89 @@
-import os
+import asyncio
 import logging
+import threading
+import httpx
+import orjson
+from postgrest import APIResponse
 from supabase import create_client, Client
-from typing import Optional
+from supabase.lib.client_options import SyncClientOptions
+from config import get_configuracion
+from typing import Any, Optional
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+# Pool de conexiones HTTP hacia PostgREST: las consultas se ejecutan en el
+# pool de hilos por defecto (hasta 32 hilos), así que se dimensiona igual
+SUPABASE_MAX_CONEXIONES = 32
+SUPABASE_TIMEOUT_SEG = 120.0
+# Conexiones ociosas abiertas hasta 5 minutos para no repetir el handshake TLS
+SUPABASE_KEEPALIVE_SEG = 300.0
+# Reintentos solo ante fallos al establecer la conexión (no repite peticiones)
+SUPABASE_REINTENTOS_CONEXION = 2
 
-class SupabaseClient:
-    """Cliente singleton para conexión con Supabase"""
-    
-    _instance: Optional['SupabaseClient'] = None
-    _client: Optional[Client] = None
+
+def _decodificar_respuesta(request_response: httpx.Response) -> APIResponse:
+    """
+    Construye la respuesta de PostgREST decodificando el cuerpo con orjson
     
-    def __new__(cls) -> 'SupabaseClient':
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+    Sustituye a APIResponse.from_http_request_response, que valida el JSON con
+    un TypeAdapter de pydantic recursivo: unas 10 veces más lento en historiales largos.
     
-    def __init__(self) -> None:
-        # No inicializar automáticamente aquí
-        pass
+    Args:
+        request_response: Respuesta HTTP de PostgREST
+        
+    Returns:
+        APIResponse con .data y .count
+    """
+    count = APIResponse._get_count_from_http_request_response(request_response)
+    try:
+        data = orjson.loads(request_response.content)
+    except orjson.JSONDecodeError:
+        data = request_response.text if len(request_response.text) > 0 else []
+    return APIResponse.model_construct(data=data, count=count)
+
+
+# Solo se sustituye si postgrest expone la API interna que usa _decodificar_respuesta
+# (versión fijada en requirements.txt); si no, se conserva la decodificación original
+if hasattr(APIResponse, "_get_count_from_http_request_response"):
+    APIResponse.from_http_request_response = staticmethod(_decodificar_respuesta)
+else:
+    logger.warning("postgrest APIResponse changed, keeping its default JSON decoding")
+
+
+# Cliente compartido, creado en la primera llamada a get_supabase_client()
+_client: Optional[Client] = None
+_http_client: Optional[httpx.Client] = None
+_lock = threading.Lock()
+
+
+def _crear_cliente() -> Client:
+    """Crea el cliente de Supabase sobre un pool de conexiones HTTP propio"""
+    global _http_client
     
-    def _initialize_client(self) -> None:
-        """Inicializa el cliente de Supabase"""
-        if self._client is not None:
-            return
-            
-        try:
-            url = os.getenv("SUPABASE_URL")
-            key = os.getenv("SUPABASE_KEY")
-            
-            if not url or not key:
-                raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
-            
-            self._client = create_client(url, key)
-            logger.info("Supabase client initialized successfully")
-            
-        except Exception as e:
-            logger.error(f"Failed to initialize Supabase client: {e}")
-            raise
+    configuracion = get_configuracion()
     
-    @property
-    def client(self) -> Client:
-        """Retorna la instancia del cliente Supabase"""
-        if self._client is None:
-            self._initialize_client()
-        return self._client
+    if not configuracion.supabase_configurado:
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
     
-    def test_connection(self) -> bool:
-        """Prueba la conexión con Supabase"""
-        try:
-            # Intentar obtener información de la tabla usuarios
-            response = self.client.table('usuarios').select('id').limit(1).execute()
-            logger.info("Supabase connection test successful")
-            return True
-        except Exception as e:
-            logger.error(f"Supabase connection test failed: {e}")
-            return False
-
-
-# Instancia global del cliente
-_supabase_client_instance = None
+    _http_client = httpx.Client(
+        transport=httpx.HTTPTransport(
+            limits=httpx.Limits(
+                max_connections=SUPABASE_MAX_CONEXIONES,
+                max_keepalive_connections=SUPABASE_MAX_CONEXIONES,
+                keepalive_expiry=SUPABASE_KEEPALIVE_SEG
+            ),
+            retries=SUPABASE_REINTENTOS_CONEXION
+        ),
+        timeout=SUPABASE_TIMEOUT_SEG
+    )
+    client = create_client(
+        configuracion.supabase_url,
+        configuracion.supabase_key,
+        options=SyncClientOptions(httpx_client=_http_client)
+    )
+    logger.info("Supabase client initialized successfully")
+    return client
 
 
 def get_supabase_client() -> Client:
@@ -72,9 +94,49 @@ def get_supabase_client() -> Client:
         Client: Instancia del cliente Supabase
         
     Raises:
-        RuntimeError: Si el cliente no está inicializado
+        ValueError: Si faltan SUPABASE_URL o SUPABASE_KEY
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = _crear_cliente()
+    return _client
+
+
+def probar_conexion() -> bool:
+    """Prueba la conexión con Supabase"""
+    try:
+        # Intentar obtener información de la tabla usuarios
+        get_supabase_client().table('usuarios').select('id').limit(1).execute()
+        logger.info("Supabase connection test successful")
+        return True
+    except Exception as e:
+        logger.error("Supabase connection test failed: %s", e)
+        return False
+
+
+def cerrar_cliente() -> None:
+    """Cierra el pool de conexiones HTTP; la siguiente llamada crea un cliente nuevo"""
+    global _client, _http_client
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+        _client = None
+        _http_client = None
+
+
+async def ejecutar_consulta(consulta: Any) -> Any:
+    """
+    Ejecuta una consulta del cliente Supabase sin bloquear el event loop
+    
+    El cliente de supabase-py es síncrono: execute() hace la petición HTTP
+    bloqueando el hilo, así que se ejecuta en el pool de hilos por defecto.
+    
+    Args:
+        consulta: Consulta construida con client.table(...) pendiente de execute()
+        
+    Returns:
+        Respuesta de la consulta (con .data y .count)
     """
-    global _supabase_client_instance
-    if _supabase_client_instance is None:
-        _supabase_client_instance = SupabaseClient()
-    return _supabase_client_instance.client
\ No newline at end of file
+    return await asyncio.to_thread(consulta.execute)
\ No newline at end of file
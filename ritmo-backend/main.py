@@ -1,28 +1,41 @@
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from dotenv import load_dotenv
-import os
 
+from config import get_configuracion
 from routers.contexto import router as contexto_router
 from routers.chat import router as chat_router
 from routers.admin import router as admin_router
+from agents.conversacional import claude_client
+from db.supabase_client import cerrar_cliente, probar_conexion
 
-# Cargar variables de entorno
-load_dotenv()
+# Configuración leída una sola vez (config.py carga el archivo .env al importarse)
+configuracion = get_configuracion()
 
-# Verificar que las variables estén cargadas
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-
-if not SUPABASE_URL or not SUPABASE_KEY:
+if not configuracion.supabase_configurado:
     print("ADVERTENCIA: Variables de entorno SUPABASE_URL y/o SUPABASE_KEY no encontradas")
     print("   Asegúrate de configurar el archivo .env correctamente")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Precalienta la conexión con Supabase y libera recursos compartidos al apagar el servidor"""
+    if configuracion.supabase_configurado:
+        # Abre la primera conexión del pool antes de recibir peticiones
+        await asyncio.to_thread(probar_conexion)
+    yield
+    if claude_client:
+        await claude_client.aclose()
+    cerrar_cliente()
+
+
 # Inicializar FastAPI
 app = FastAPI(
     title="RITMO Backend",
     description="API para Agente de Contexto de Vida y Patrones y Señales Web",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Registrar routers
@@ -53,7 +66,7 @@ async def health_check():
     return {
         "status": "ok",
         "service": "ritmo-backend",
-        "supabase_configured": bool(SUPABASE_URL and SUPABASE_KEY)
+        "supabase_configured": configuracion.supabase_configurado
     }
 
 if __name__ == "__main__":
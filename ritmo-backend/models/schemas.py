@@ -3,13 +3,21 @@ Schemas Pydantic para RITMO Backend - Persona A
 Modelos de datos para el endpoint /contexto
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Literal, Optional, List, Dict
-from datetime import datetime
+from datetime import datetime, timezone
+
+
+def _ahora_utc() -> datetime:
+    """Instante actual en UTC (con zona horaria)"""
+    return datetime.now(timezone.utc)
 
 
 class PerfilUsuario(BaseModel):
     """Perfil del usuario con su etapa de vida y preferencias"""
+    # Inmutable y hashable: se puede usar como clave de caché
+    model_config = ConfigDict(frozen=True)
+    
     etapa: Literal["mayor_70", "adulto_activo", "joven", "migrante", "discapacidad_visual"] = Field(
         ..., description="Etapa de vida del usuario"
     )
@@ -24,6 +32,8 @@ class PerfilUsuario(BaseModel):
 
 class SenalesWeb(BaseModel):
     """Señales del comportamiento web del usuario"""
+    model_config = ConfigDict(frozen=True)
+    
     hora_acceso: str = Field(..., description="Hora de acceso en formato HH:MM")
     dia_semana: str = Field(..., description="Día de la semana")
     es_madrugada: bool = Field(..., description="Si el acceso es en madrugada")
@@ -38,6 +48,8 @@ class SenalesWeb(BaseModel):
 
 class EstadoInferido(BaseModel):
     """Estado inferido del usuario basado en las señales"""
+    model_config = ConfigDict(frozen=True)
+    
     estado: Literal["estable", "cansancio", "aislamiento", "ansiedad", "desconexion"] = Field(
         ..., description="Estado inferido del usuario"
     )
@@ -51,6 +63,8 @@ class EstadoInferido(BaseModel):
 
 class ContextoResponse(BaseModel):
     """Respuesta completa del endpoint /contexto"""
+    model_config = ConfigDict(frozen=True)
+    
     contexto_sistema: str = Field(..., description="Instrucciones para Claude")
     estado_inferido: EstadoInferido = Field(..., description="Estado inferido del usuario")
     recomendacion_orquestador: Literal["esperar", "contacto_suave", "rutina", "silencio"] = Field(
@@ -60,6 +74,8 @@ class ContextoResponse(BaseModel):
 
 class ContextoRequest(BaseModel):
     """Request completo al endpoint /contexto"""
+    model_config = ConfigDict(frozen=True)
+    
     perfil: PerfilUsuario = Field(..., description="Perfil del usuario")
     señales: SenalesWeb = Field(..., description="Señales del comportamiento web")
 
@@ -67,6 +83,8 @@ class ContextoRequest(BaseModel):
 # Modelos adicionales para interacción con Supabase
 class SesionWeb(BaseModel):
     """Modelo para guardar sesión web en Supabase"""
+    model_config = ConfigDict(frozen=True)
+    
     user_id: str = Field(..., description="ID del usuario")
     hora_inicio: datetime = Field(..., description="Hora de inicio de sesión")
     hora_fin: Optional[datetime] = Field(None, description="Hora de fin de sesión")
@@ -78,10 +96,12 @@ class SesionWeb(BaseModel):
 
 class EventoComportamiento(BaseModel):
     """Modelo para guardar evento de comportamiento en Supabase"""
+    model_config = ConfigDict(frozen=True)
+    
     user_id: str = Field(..., description="ID del usuario")
     tipo_evento: str = Field(..., description="Tipo de evento")
     valor: str = Field(..., description="Valor del evento")
-    timestamp: datetime = Field(default_factory=datetime.utcnow, description="Timestamp del evento")
+    timestamp: datetime = Field(default_factory=_ahora_utc, description="Timestamp del evento")
 
 
 # === NUEVOS SCHEMAS PARA CHAT Y PROACTIVO ===
@@ -98,6 +118,8 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     """Response del endpoint /chat"""
+    model_config = ConfigDict(frozen=True)
+    
     respuesta: str = Field(..., description="Respuesta generada por Claude")
     tono: Literal["empático", "alentador", "neutral", "celebratorio"] = Field(
         ..., description="Tono de la respuesta"
@@ -106,12 +128,14 @@ class ChatResponse(BaseModel):
         default=False, description="Si necesita seguimiento posterior"
     )
     timestamp: datetime = Field(
-        default_factory=datetime.utcnow, description="Timestamp de la respuesta"
+        default_factory=_ahora_utc, description="Timestamp de la respuesta"
     )
 
 
 class ProactivoRequest(BaseModel):
     """Request para el endpoint /proactivo"""
+    model_config = ConfigDict(frozen=True)
+    
     user_id: str = Field(..., description="ID del usuario")
     perfil: PerfilUsuario = Field(..., description="Perfil del usuario")
     estado_actual: EstadoInferido = Field(..., description="Estado inferido actual")
@@ -123,6 +147,8 @@ class ProactivoRequest(BaseModel):
 
 class ProactivoResponse(BaseModel):
     """Response del endpoint /proactivo"""
+    model_config = ConfigDict(frozen=True)
+    
     mensaje: str = Field(..., description="Mensaje proactivo generado")
     canal_recomendado: Literal["chat", "notificacion", "email"] = Field(
         ..., description="Canal recomendado para enviar el mensaje"
@@ -137,6 +163,8 @@ class ProactivoResponse(BaseModel):
 
 class PrediccionRiesgo(BaseModel):
     """Predicción de riesgo usando ML"""
+    model_config = ConfigDict(frozen=True)
+    
     probabilidad_riesgo: float = Field(
         ..., ge=0, le=1, description="Probabilidad de riesgo (0-1)"
     )
@@ -155,6 +183,8 @@ class PrediccionRiesgo(BaseModel):
 
 class EstadisticasAdmin(BaseModel):
     """Estadísticas anonimizadas para admin"""
+    model_config = ConfigDict(frozen=True)
+    
     total_usuarios_activos: int = Field(..., description="Usuarios activos (últimos 7 días)")
     sesiones_hoy: int = Field(..., description="Sesiones iniciadas hoy")
     promedio_duracion_sesion_min: float = Field(
@@ -173,5 +203,5 @@ class EstadisticasAdmin(BaseModel):
         ..., description="Tendencias de uso por día de la semana"
     )
     fecha_generacion: datetime = Field(
-        default_factory=datetime.utcnow, description="Fecha de generación del reporte"
+        default_factory=_ahora_utc, description="Fecha de generación del reporte"
     )
\ No newline at end of file
@@ -3,14 +3,15 @@ Router para endpoints administrativos
 Proporciona estadísticas anonimizadas y métricas del sistema
 """
 
+import asyncio
 import logging
 from fastapi import APIRouter, HTTPException, status, Depends
 from typing import Dict, Any, List
 from datetime import datetime, timedelta
 
 from models.schemas import EstadisticasAdmin
-from db.supabase_client import get_supabase_client
-from db.sesiones import obtener_estadisticas_uso
+from db.supabase_client import ejecutar_consulta, get_supabase_client
+from db.sesiones import contar_usuarios_unicos, obtener_agregados_admin
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -49,29 +50,37 @@ async def obtener_estadisticas_sistema(
     try:
         logger.info(f"Generating admin statistics for last {dias_atras} days")
         
-        # 1. Obtener estadísticas básicas de uso
-        stats_uso = await obtener_estadisticas_uso(dias_atras)
-        
-        # 2. Calcular usuarios activos
-        usuarios_activos = await _contar_usuarios_activos(dias_atras)
-        
-        # 3. Obtener sesiones de hoy
-        sesiones_hoy = await _contar_sesiones_hoy()
-        
-        # 4. Calcular duración promedio de sesión
-        duracion_promedio = await _calcular_duracion_promedio_sesion(dias_atras)
-        
-        # 5. Obtener distribución de estados
-        distribucion_estados = await _obtener_distribucion_estados(dias_atras)
-        
-        # 6. Obtener distribución por etapa de vida
-        distribucion_etapas = await _obtener_distribucion_etapas(dias_atras)
-        
-        # 7. Contar alertas de riesgo activas
-        alertas_activas = await _contar_alertas_riesgo_activas()
+        # Las consultas son independientes entre sí: se lanzan a la vez
+        (
+            agregados,
+            distribucion_estados,
+            distribucion_etapas,
+            alertas_activas,
+            tendencias_semanales
+        ) = await asyncio.gather(
+            # Usuarios activos, sesiones de hoy y duración promedio, agregados en Postgres
+            obtener_agregados_admin(dias_atras),
+            # Distribución de estados
+            _obtener_distribucion_estados(dias_atras),
+            # Distribución por etapa de vida
+            _obtener_distribucion_etapas(dias_atras),
+            # Alertas de riesgo activas
+            _contar_alertas_riesgo_activas(),
+            # Tendencias semanales
+            _calcular_tendencias_semanales()
+        )
         
-        # 8. Calcular tendencias semanales
-        tendencias_semanales = await _calcular_tendencias_semanales()
+        if agregados is not None:
+            usuarios_activos = agregados['usuarios_activos'] or 0
+            sesiones_hoy = agregados['sesiones_hoy'] or 0
+            duracion_seg = agregados['duracion_promedio_seg']
+            duracion_promedio = round(float(duracion_seg) / 60, 2) if duracion_seg else 0.0
+        else:
+            usuarios_activos, sesiones_hoy, duracion_promedio = await asyncio.gather(
+                _contar_usuarios_activos(dias_atras),
+                _contar_sesiones_hoy(),
+                _calcular_duracion_promedio_sesion(dias_atras)
+            )
         
         estadisticas = EstadisticasAdmin(
             total_usuarios_activos=usuarios_activos,
@@ -99,16 +108,9 @@ async def _contar_usuarios_activos(dias_atras: int) -> int:
     try:
         fecha_limite = datetime.utcnow() - timedelta(days=dias_atras)
         
+        # COUNT(DISTINCT user_id) en Postgres: no se descargan las filas
         supabase = get_supabase_client()
-        response = supabase.table("sesiones_web").select("user_id", count="exact") \
-            .gte("hora_inicio", fecha_limite.isoformat()) \
-            .execute()
-        
-        if response.data:
-            # Contar usuarios únicos
-            usuarios_unicos = len(set(sesion["user_id"] for sesion in response.data))
-            return usuarios_unicos
-        return 0
+        return await contar_usuarios_unicos(supabase, fecha_limite.isoformat())
         
     except Exception as e:
         logger.error(f"Error counting active users: {e}")
@@ -121,10 +123,11 @@ async def _contar_sesiones_hoy() -> int:
         hoy = datetime.utcnow().date()
         
         supabase = get_supabase_client()
-        response = supabase.table("sesiones_web") \
-            .select("*", count="exact") \
-            .gte("hora_inicio", hoy.isoformat()) \
-            .execute()
+        response = await ejecutar_consulta(
+            supabase.table("sesiones_web")
+            .select("*", count="exact", head=True)  # Solo el conteo, sin filas
+            .gte("hora_inicio", hoy.isoformat())
+        )
         
         return response.count if response.count else 0
     
@@ -139,11 +142,12 @@ async def _calcular_duracion_promedio_sesion(dias_atras: int) -> float:
         fecha_limite = datetime.utcnow() - timedelta(days=dias_atras)
         
         supabase = get_supabase_client()
-        response = supabase.table("sesiones_web") \
-            .select("duracion_seg") \
-            .gte("hora_inicio", fecha_limite.isoformat()) \
-            .not_.is_("duracion_seg", "null") \
-            .execute()
+        response = await ejecutar_consulta(
+            supabase.table("sesiones_web")
+            .select("duracion_seg")
+            .gte("hora_inicio", fecha_limite.isoformat())
+            .not_.is_("duracion_seg", "null")
+        )
         
         if response.data:
             duraciones = [sesion["duracion_seg"] for sesion in response.data if sesion["duracion_seg"]]
@@ -4,13 +4,14 @@ Maneja la interacción conversacional del usuario con RITMO
 """
 
 import logging
+from types import MappingProxyType
 from fastapi import APIRouter, HTTPException, status
 from typing import Dict, Any, List
 from datetime import datetime
 
 from models.schemas import (
     ChatRequest, ChatResponse, ProactivoRequest, ProactivoResponse,
-    EstadoInferido, PrediccionRiesgo
+    PrediccionRiesgo
 )
 from agents.conversacional import generar_respuesta_chat
 from agents.habitos import generar_mensaje_habito
@@ -27,6 +28,29 @@ router = APIRouter(prefix="/chat", tags=["chat"])
 # Inicializar orquestador central
 orquestador = OrquestadorCentral()
 
+# Palabras clave por tono, en orden de prioridad (urgencia o crisis primero)
+_TONOS_POR_PRIORIDAD = (
+    ("urgente", ("ayuda", "mal", "terrible", "no puedo", "desesperado",
+                 "suicidio", "morir", "acabar", "insoportable")),
+    ("positivo", ("bien", "genial", "mejor", "feliz", "contento",
+                  "gracias", "perfecto", "excelente", "logré")),
+    # Negativas pero no urgentes
+    ("negativo", ("triste", "cansado", "difícil", "complicado",
+                  "preocupado", "nervioso", "ansioso")),
+)
+
+# Estados en los que el mensaje proactivo debe ser menos intrusivo y más prioritario
+_ESTADOS_SENSIBLES = frozenset({"ansiedad", "aislamiento"})
+
+# Simplificado: horario de tarde para la mayoría de perfiles
+_HORARIOS_POR_ETAPA = MappingProxyType({
+    "mayor_70": "16:00",
+    "adulto_activo": "18:00", 
+    "joven": "19:00",
+    "migrante": "17:00",
+    "discapacidad_visual": "15:00"
+})
+
 
 @router.post("/", response_model=ChatResponse)
 async def procesar_mensaje_chat(request: ChatRequest) -> ChatResponse:
@@ -83,7 +107,8 @@ async def procesar_mensaje_chat(request: ChatRequest) -> ChatResponse:
             user_id=request.user_id,
             mensaje_usuario=request.mensaje,
             respuesta_sistema=respuesta_chat.respuesta,
-            tono=respuesta_chat.tono
+            tono=respuesta_chat.tono,
+            timestamp=respuesta_chat.timestamp
         )
         
         logger.info(f"Chat response generated successfully for user: {request.user_id}")
@@ -136,7 +161,7 @@ async def generar_mensaje_proactivo(request: ProactivoRequest) -> ProactivoRespo
         # 2. Generar contenido según el tipo
         if request.tipo_mensaje == "habito" and request.estado_actual.estado == "estable":
             # Usar agente de hábitos para usuarios estables
-            mensaje_respuesta = await generar_mensaje_habito(
+            mensaje_respuesta = generar_mensaje_habito(
                 perfil=request.perfil,
                 dias_sin_actividad=request.dias_sin_actividad
             )
@@ -152,9 +177,10 @@ async def generar_mensaje_proactivo(request: ProactivoRequest) -> ProactivoRespo
             )
         
         # 3. Determinar canal y timing optimal
-        canal_recomendado = _determinar_canal_optimo(request.estado_actual, request.perfil)
-        momento_optimo = _calcular_momento_optimo(request.perfil)
-        prioridad = _calcular_prioridad(request.estado_actual, request.dias_sin_actividad)
+        estado = request.estado_actual.estado
+        canal_recomendado = _determinar_canal_optimo(estado, request.perfil.modo_comunicacion)
+        momento_optimo = _calcular_momento_optimo(request.perfil.etapa)
+        prioridad = _calcular_prioridad(estado, request.dias_sin_actividad)
         
         respuesta = ProactivoResponse(
             mensaje=mensaje_respuesta.respuesta,
@@ -196,56 +222,34 @@ def _analizar_tono_mensaje(mensaje: str) -> str:
     """
     mensaje_lower = mensaje.lower()
     
-    # Palabras que indican urgencia o crisis
-    palabras_urgentes = ["ayuda", "mal", "terrible", "no puedo", "desesperado", 
-                        "suicidio", "morir", "acabar", "insoportable"]
-    
-    # Palabras positivas
-    palabras_positivas = ["bien", "genial", "mejor", "feliz", "contento", 
-                         "gracias", "perfecto", "excelente", "logré"]
-    
-    # Palabras negativas pero no urgentes
-    palabras_negativas = ["triste", "cansado", "difícil", "complicado", 
-                         "preocupado", "nervioso", "ansioso"]
-    
-    if any(palabra in mensaje_lower for palabra in palabras_urgentes):
-        return "urgente"
-    elif any(palabra in mensaje_lower for palabra in palabras_positivas):
-        return "positivo"
-    elif any(palabra in mensaje_lower for palabra in palabras_negativas):
-        return "negativo"
-    else:
-        return "neutral"
+    # Bucle explícito: sale en la primera coincidencia sin crear generadores
+    for tono, palabras in _TONOS_POR_PRIORIDAD:
+        for palabra in palabras:
+            if palabra in mensaje_lower:
+                return tono
+    return "neutral"
 
 
-def _determinar_canal_optimo(estado: EstadoInferido, perfil) -> str:
+def _determinar_canal_optimo(estado: str, modo_comunicacion: str) -> str:
     """Determina el canal óptimo para el mensaje proactivo"""
-    if estado.estado in ["ansiedad", "aislamiento"]:
+    if estado in _ESTADOS_SENSIBLES:
         return "notificacion"  # Menos intrusivo
-    elif perfil.modo_comunicacion == "audio":
+    elif modo_comunicacion == "audio":
         return "chat"  # Puede usar audio
     else:
         return "chat"  # Default
 
 
-def _calcular_momento_optimo(perfil) -> str:
+def _calcular_momento_optimo(etapa: str) -> str:
     """Calcula el momento óptimo para enviar el mensaje"""
-    # Simplificado: horario de tarde para la mayoría de perfiles
-    horarios_por_etapa = {
-        "mayor_70": "16:00",
-        "adulto_activo": "18:00", 
-        "joven": "19:00",
-        "migrante": "17:00",
-        "discapacidad_visual": "15:00"
-    }
-    return horarios_por_etapa.get(perfil.etapa, "17:00")
+    return _HORARIOS_POR_ETAPA.get(etapa, "17:00")
 
 
-def _calcular_prioridad(estado: EstadoInferido, dias_sin_actividad: int) -> str:
+def _calcular_prioridad(estado: str, dias_sin_actividad: int) -> str:
     """Calcula la prioridad del mensaje proactivo"""
-    if estado.estado in ["ansiedad", "aislamiento"] or dias_sin_actividad > 3:
+    if estado in _ESTADOS_SENSIBLES or dias_sin_actividad > 3:
         return "alta"
-    elif estado.estado == "cansancio" or dias_sin_actividad > 1:
+    elif estado == "cansancio" or dias_sin_actividad > 1:
         return "media"
     else:
         return "baja"
@@ -0,0 +1,169 @@
+"""
+Tests para el agente conversacional
+Valida el análisis y post-procesado de respuestas sin llamar a Claude
+"""
+
+import asyncio
+
+import pytest
+
+from agents.conversacional import (
+    CLAUDE_MAX_CONCURRENCIA, ClaudeAPIClient,
+    _determinar_tono_respuesta, _generar_respuesta_local, _procesar_respuesta_final
+)
+from models.schemas import PerfilUsuario
+
+
+class TestTonoRespuesta:
+    """Tests de la detección de tono de la respuesta generada"""
+    
+    @pytest.mark.parametrize("respuesta, tono_esperado", [
+        ("¡Felicidades por tu logro!", "celebratorio"),
+        ("Entiendo que hoy ha sido un día DIFÍCIL.", "empático"),
+        ("Tú puedes con esto, ánimo.", "alentador"),
+        ("Hola, ¿qué tal la mañana?", "neutral"),
+    ])
+    def test_tono_por_palabras_clave(self, respuesta, tono_esperado):
+        """Cada grupo de palabras clave produce su tono"""
+        assert _determinar_tono_respuesta(respuesta, {}) == tono_esperado
+    
+    def test_celebratorio_tiene_prioridad(self):
+        """El tono celebratorio gana aunque aparezca después de otras palabras"""
+        respuesta = "Entiendo lo que sientes, y es genial que lo hayas logrado."
+        assert _determinar_tono_respuesta(respuesta, {}) == "celebratorio"
+    
+    def test_empatico_tiene_prioridad_sobre_alentador(self):
+        """El tono empático gana al alentador independientemente del orden"""
+        respuesta = "Adelante, comprendo que cueste."
+        assert _determinar_tono_respuesta(respuesta, {}) == "empático"
+
+
+class TestProcesarRespuestaFinal:
+    """Tests del ajuste final de longitud y formato"""
+    
+    @pytest.fixture
+    def perfil_texto(self):
+        return PerfilUsuario(etapa="joven", nombre="Alex", modo_comunicacion="texto")
+    
+    def test_respuesta_larga_se_corta_en_ultima_oracion(self, perfil_texto):
+        """Respuestas de más de 200 caracteres se cortan en la última oración antes de 180"""
+        respuesta = "Primera frase corta. " + "a" * 100 + "! " + "b" * 150 + "."
+        resultado = _procesar_respuesta_final(respuesta, perfil_texto)
+        assert resultado == "Primera frase corta. " + "a" * 100 + "!"
+    
+    def test_respuesta_larga_sin_puntos_no_se_corta(self, perfil_texto):
+        """Sin final de oración antes del carácter 180 la respuesta se mantiene"""
+        respuesta = "a" * 250 + "."
+        assert _procesar_respuesta_final(respuesta, perfil_texto) == respuesta
+
+
+class TestRespuestaLocal:
+    """Tests de las respuestas locales cuando Claude no está disponible"""
+    
+    @pytest.fixture
+    def perfil(self):
+        return PerfilUsuario(etapa="mayor_70", nombre="Carmen", modo_comunicacion="audio")
+    
+    @pytest.mark.parametrize("mensaje, tono_esperado", [
+        ("Hoy me siento mal", "empático"),
+        ("Estoy mejor que ayer", "celebratorio"),
+        ("Un día normal, sin más", "neutral"),
+    ])
+    def test_tono_segun_mensaje(self, perfil, mensaje, tono_esperado):
+        """El mensaje del usuario determina la plantilla y el tono"""
+        respuesta = _generar_respuesta_local(mensaje, {}, perfil, modo_proactivo=False)
+        assert respuesta.tono == tono_esperado
+        assert "Carmen" in respuesta.respuesta
+        assert respuesta.timestamp is not None
+    
+    def test_modo_proactivo_es_estable_por_usuario(self, perfil):
+        """El mismo usuario recibe siempre el mismo saludo proactivo"""
+        primera = _generar_respuesta_local("", {}, perfil, modo_proactivo=True)
+        segunda = _generar_respuesta_local("", {}, perfil, modo_proactivo=True)
+        assert primera.respuesta == segunda.respuesta
+        assert primera.tono == "empático"
+
+
+class _RespuestaSimulada:
+    """Respuesta HTTP mínima con cuerpo SSE línea a línea"""
+    
+    def __init__(self, lineas, error=None):
+        self.status = 200
+        self.liberada = False
+        self._lineas = lineas
+        self._error = error
+    
+    @property
+    def content(self):
+        return self._leer()
+    
+    async def _leer(self):
+        for linea in self._lineas:
+            yield linea
+        if self._error:
+            raise self._error
+    
+    def release(self):
+        self.liberada = True
+
+
+class TestStreamClaude:
+    """Tests del parseo del stream SSE de Claude con una sesión simulada"""
+    
+    def _cliente(self, respuesta):
+        cliente = ClaudeAPIClient("clave")
+        
+        class _Sesion:
+            async def post(self, url, data):
+                return respuesta
+        
+        async def _get_session():
+            return _Sesion()
+        
+        cliente._get_session = _get_session
+        return cliente
+    
+    def test_texto_en_fragmentos(self):
+        """Los deltas de texto se concatenan y la respuesta se libera"""
+        respuesta = _RespuestaSimulada([
+            b"event: content_block_delta\n",
+            b'data: {"type":"content_block_delta","delta":{"text":"Hola, "}}\n',
+            b"event: content_block_delta\n",
+            b'data: {"type":"content_block_delta","delta":{"text":"Alex"}}\n',
+        ])
+        cliente = self._cliente(respuesta)
+        assert asyncio.run(cliente.generar_respuesta("hola")) == "Hola, Alex"
+        assert respuesta.liberada
+    
+    def test_semaforo_libre_mientras_se_consume(self):
+        """El permiso de concurrencia no se retiene entre fragmentos emitidos"""
+        cliente = self._cliente(_RespuestaSimulada([
+            b"event: content_block_delta\n",
+            b'data: {"type":"content_block_delta","delta":{"text":"Hola"}}\n',
+        ]))
+        
+        async def primer_fragmento():
+            stream = cliente.generar_respuesta_stream("hola")
+            texto = await anext(stream)
+            return texto, cliente._semaforo._value
+        
+        assert asyncio.run(primer_fragmento()) == ("Hola", CLAUDE_MAX_CONCURRENCIA)
+    
+    @pytest.mark.parametrize("lineas", [
+        [],
+        [b"event: error\n", b'data: {"type":"error","error":{"type":"overloaded_error"}}\n'],
+    ])
+    def test_sin_texto_usa_fallback(self, lineas):
+        """Un stream vacío o con evento de error devuelve la respuesta de fallback"""
+        cliente = self._cliente(_RespuestaSimulada(lineas))
+        assert asyncio.run(cliente.generar_respuesta("hola")) == cliente._generar_respuesta_fallback("hola")
+    
+    def test_corte_tras_texto_parcial_no_se_da_por_completo(self):
+        """Si el stream falla a mitad se descarta el texto parcial"""
+        respuesta = _RespuestaSimulada(
+            [b"event: content_block_delta\n", b'data: {"type":"content_block_delta","delta":{"text":"Hola"}}\n'],
+            error=ConnectionResetError()
+        )
+        cliente = self._cliente(respuesta)
+        assert asyncio.run(cliente.generar_respuesta("hola")) == cliente._generar_respuesta_fallback("hola")
+        assert respuesta.liberada
@@ -0,0 +1,176 @@
+"""
+Tests para el agente de predicción ML
+Usa un modelo y un historial simulados para no depender del telegram-bot ni de Supabase
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from agents import prediccion_ml
+from agents.prediccion_ml import PredictorRiesgoML
+from models.schemas import PerfilUsuario
+
+
+class _ScalerIdentidad:
+    def transform(self, x):
+        return x
+
+
+class _ModeloFijo:
+    def __init__(self):
+        self.llamadas = 0
+
+    def predict_proba(self, x):
+        self.llamadas += 1
+        return np.tile([0.3, 0.7], (len(x), 1))
+
+
+class TestCachePredicciones:
+    """Tests de la caché de predicciones por (usuario, mensaje)"""
+
+    @pytest.fixture
+    def predictor(self, monkeypatch):
+        self.consultas_historial = 0
+
+        async def historial_falso(user_id, dias_atras=30):
+            self.consultas_historial += 1
+            return []
+
+        monkeypatch.setattr(prediccion_ml, "obtener_historial_usuario", historial_falso)
+        predictor = PredictorRiesgoML()
+        predictor.modelo_cargado = True
+        predictor.modelo = _ModeloFijo()
+        predictor.scaler = _ScalerIdentidad()
+        return predictor
+
+    @pytest.fixture
+    def perfil(self):
+        return PerfilUsuario(etapa="joven", nombre="Alex", modo_comunicacion="texto")
+
+    def test_mensaje_repetido_reutiliza_prediccion(self, predictor, perfil):
+        """El mismo mensaje del mismo usuario no vuelve a consultar historial ni modelo"""
+        primera = asyncio.run(predictor.predecir_riesgo_completo("u1", "hola", perfil))
+        segunda = asyncio.run(predictor.predecir_riesgo_completo("u1", "hola", perfil))
+
+        assert segunda is primera
+        assert self.consultas_historial == 1
+        assert predictor.modelo.llamadas == 1
+
+    def test_otro_usuario_no_comparte_entrada(self, predictor, perfil):
+        """Cada usuario tiene su propia entrada; el vector repetido sí reutiliza el modelo"""
+        asyncio.run(predictor.predecir_riesgo_completo("u1", "hola", perfil))
+        asyncio.run(predictor.predecir_riesgo_completo("u2", "hola", perfil))
+
+        assert self.consultas_historial == 2
+        assert predictor.modelo.llamadas == 1
+
+    def test_prediccion_caducada_se_recalcula(self, predictor, perfil, monkeypatch):
+        """Pasado el TTL se vuelve a consultar el historial"""
+        monkeypatch.setattr(prediccion_ml, "PREDICCION_CACHE_TTL_SEG", -1)
+        asyncio.run(predictor.predecir_riesgo_completo("u1", "hola", perfil))
+        asyncio.run(predictor.predecir_riesgo_completo("u1", "hola", perfil))
+
+        assert self.consultas_historial == 2
+
+
+class TestPrediccionBatch:
+    """Tests de la predicción por lotes"""
+
+    @pytest.fixture
+    def perfil(self):
+        return PerfilUsuario(etapa="joven", nombre="Alex", modo_comunicacion="texto")
+
+    def test_lote_llama_al_modelo_una_vez(self, monkeypatch, perfil):
+        """Todo el lote se resuelve con una única llamada a predict_proba"""
+        async def historial_falso(user_id, dias_atras=30):
+            return []
+
+        monkeypatch.setattr(prediccion_ml, "obtener_historial_usuario", historial_falso)
+        predictor = PredictorRiesgoML()
+        predictor.modelo_cargado = True
+        predictor.modelo = _ModeloFijo()
+        predictor.scaler = _ScalerIdentidad()
+
+        items = [("u1", "hola", perfil), ("u2", "me siento mal", perfil), ("u3", "genial", perfil)]
+        predicciones = asyncio.run(predictor.predecir_riesgo_batch(items))
+
+        assert len(predicciones) == 3
+        assert predictor.modelo.llamadas == 1
+        individual = asyncio.run(predictor.predecir_riesgo_completo("u2", "me siento mal", perfil))
+        assert predicciones[1] == individual
+
+    def test_sin_modelo_usa_heuristica(self, perfil):
+        """Sin modelo cargado cada mensaje recibe la predicción heurística"""
+        predictor = PredictorRiesgoML()
+        predictor.modelo_cargado = False
+
+        predicciones = asyncio.run(predictor.predecir_riesgo_batch([("u1", "quiero morir", perfil)]))
+
+        assert predicciones[0].factores_riesgo[0] == "lenguaje_crisis"
+
+
+class TestCachePatrones:
+    """Tests de la caché del análisis de patrones históricos por usuario"""
+
+    def test_historial_sin_cambios_no_se_recalcula(self, monkeypatch):
+        """Mientras la huella del historial no cambie se reutiliza el análisis"""
+        calculos = []
+        original = PredictorRiesgoML._calcular_patrones_historicos
+        monkeypatch.setattr(
+            PredictorRiesgoML, "_calcular_patrones_historicos",
+            lambda self, historial: calculos.append(1) or original(self, historial)
+        )
+        predictor = PredictorRiesgoML()
+        historial = [{"mensaje_usuario": "estoy triste", "timestamp": "2024-01-01T10:00:00"}]
+
+        primero = asyncio.run(predictor._analizar_patrones_historicos(historial, "u1"))
+        segundo = asyncio.run(predictor._analizar_patrones_historicos(list(historial), "u1"))
+        historial.append({"mensaje_usuario": "mejor", "timestamp": "2024-01-01T11:00:00"})
+        tercero = asyncio.run(predictor._analizar_patrones_historicos(historial, "u1"))
+
+        assert primero == segundo
+        assert tercero["racha_negativa"] == 1
+        assert len(calculos) == 2
+
+
+    def test_huella_detecta_cambio_de_sesiones(self):
+        """Con el formato real del historial, rotar una sesión cambia la huella"""
+        historial = {
+            "sesiones": [
+                {"user_id": "u1", "hora_inicio": "2024-01-01T10:00:00+00:00"},
+                {"user_id": "u1", "hora_inicio": "2024-01-02T10:00:00+00:00"},
+            ],
+            "chat_messages": [{"mensaje_usuario": "hola", "timestamp": "2024-01-02T10:05:00+00:00"}],
+            "eventos": [],
+        }
+        rotado = dict(historial, sesiones=[
+            historial["sesiones"][1],
+            {"user_id": "u1", "hora_inicio": "2024-01-03T10:00:00+00:00"},
+        ])
+
+        assert prediccion_ml._huella_historial(historial) != prediccion_ml._huella_historial(rotado)
+
+
+class TestActividadReciente:
+    """Tests del conteo de mensajes de las últimas 24 horas"""
+
+    @pytest.fixture
+    def perfil(self):
+        return PerfilUsuario(etapa="joven", nombre="Alex", modo_comunicacion="texto")
+
+    def test_timestamps_con_zona_horaria(self, perfil):
+        """Timestamps con offset (como los devuelve Supabase), con 'Z' y sin zona cuentan igual"""
+        hace_una_hora = datetime.now(timezone.utc) - timedelta(hours=1)
+        historial = [
+            {"timestamp": hace_una_hora.isoformat()},
+            {"timestamp": hace_una_hora.astimezone(timezone(timedelta(hours=2))).isoformat()},
+            {"timestamp": hace_una_hora.replace(tzinfo=None).isoformat() + "Z"},
+            {"timestamp": hace_una_hora.replace(tzinfo=None).isoformat()},
+            {"timestamp": (hace_una_hora - timedelta(days=2)).isoformat()},
+        ]
+        caracteristicas = PredictorRiesgoML()._extraer_caracteristicas_basicas("hola", historial, perfil)
+
+        assert caracteristicas[0][3] == pytest.approx(4 / 10.0)
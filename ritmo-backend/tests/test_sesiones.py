@@ -0,0 +1,42 @@
+"""
+Tests para el acceso a datos de sesiones
+Usa un cliente Supabase simulado
+"""
+
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from db import sesiones
+from models.schemas import SenalesWeb
+
+
+class TestSinClienteSupabase:
+    """Tests de los valores de respaldo cuando Supabase no está configurado"""
+
+    @pytest.fixture(autouse=True)
+    def sin_cliente(self):
+        error = ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+        with patch('db.sesiones.get_supabase_client', side_effect=error):
+            yield
+
+    def test_lecturas_devuelven_vacio(self):
+        """Historial de chat e historial completo devuelven colecciones vacías"""
+        assert asyncio.run(sesiones.obtener_historial_chat("u1")) == []
+        historial = asyncio.run(sesiones.obtener_historial_usuario("u1"))
+        assert historial == {'sesiones': [], 'chat_messages': [], 'eventos': []}
+
+    def test_agregados_admin_devuelven_none(self):
+        """Sin cliente los agregados del panel admin caen al cálculo de respaldo"""
+        assert asyncio.run(sesiones.obtener_agregados_admin(7)) is None
+
+    def test_escrituras_no_lanzan(self):
+        """Guardar mensaje devuelve None y guardar eventos devuelve False"""
+        señales = SenalesWeb(
+            hora_acceso="03:00", dia_semana="lunes", es_madrugada=True,
+            frecuencia_accesos_hoy=1, duracion_sesion_anterior_seg=60,
+            tiempo_respuesta_usuario_seg=10, dias_sin_registrar=0
+        )
+        assert asyncio.run(sesiones.guardar_mensaje("u1", "hola", "hola", "neutral")) is None
+        assert asyncio.run(sesiones.guardar_eventos_señales("u1", señales)) is False